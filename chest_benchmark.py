@@ -0,0 +1,446 @@
+"""性能基准和回归检查 / Benchmarks and regression harness for the probability engine
+
+用法:
+    python chest_benchmark.py                         # 运行全部基准
+    python chest_benchmark.py engine batch --output results.json
+    python chest_benchmark.py --baseline baseline.json   # 与基线比较，变慢时返回非零
+    python chest_benchmark.py check                   # 各快速路径与参考动态规划的数值一致性
+输出为 JSON，便于脚本处理。
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+from fractions import Fraction
+
+import numpy as np
+
+import chest_engine
+import chest_simulation
+
+# (等级数量, 每级升级概率, 升级次数)：覆盖普通情形、极小尾部概率和浮点下溢的情形
+PRECISION_CASES = [
+    (5, 0.45, 100),
+    (30, 1e-3, 400),
+    (120, 1e-4, 300),
+    (8, 1e-30, 5),
+]
+
+
+def fraction_log(value):
+    """有理数的自然对数，先按二进制位数缩放，避免大整数直接取对数丢失精度"""
+    if value == 0:
+        return -math.inf
+    shift = value.numerator.bit_length() - value.denominator.bit_length()
+    if shift >= 0:
+        scaled = Fraction(value.numerator, value.denominator << shift)
+    else:
+        scaled = Fraction(value.numerator << -shift, value.denominator)
+    return math.log(scaled) + shift * math.log(2)
+
+
+def time_call(func, repeat):
+    """返回多次调用中最短的耗时（秒）和最后一次的结果"""
+    best = math.inf
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def max_relative_error(log_values, exact_log):
+    """以精确结果为参考的最大相对误差；精确值非零而结果为0（下溢）时为 inf"""
+    nonzero = np.isfinite(exact_log)
+    diff = np.where(np.isfinite(log_values[nonzero]), log_values[nonzero] - exact_log[nonzero], np.inf)
+    return float(np.max(np.abs(np.expm1(diff)))) if diff.size else 0.0
+
+
+def benchmark_precision(cases=PRECISION_CASES, repeat=3):
+    """比较 float、log 和 exact 三种精度路径的耗时和相对误差"""
+    records = []
+    for level_count, chance, n in cases:
+        q = [chance] * (level_count - 1)
+
+        exact_seconds, exact = time_call(
+            lambda: chest_engine.compute_distribution_exact(level_count, 1, q, n), 1)
+        exact_log = np.array([fraction_log(value) for value in exact])
+        smallest = float(np.min(exact_log[np.isfinite(exact_log)]) / math.log(10))
+
+        float_seconds, p = time_call(
+            lambda: chest_engine.compute_distribution(level_count, 1, q, n), repeat)
+        with np.errstate(divide="ignore"):
+            float_log = np.log(p)
+
+        log_seconds, log_p = time_call(
+            lambda: chest_engine.compute_log_distribution(level_count, 1, q, n), repeat)
+
+        base = {"suite": "precision", "levels": level_count, "upgrade_probability": chance, "n": n,
+                "smallest_log10_probability": smallest}
+        name = f"precision/L{level_count}/q{chance:g}/n{n}"
+        records.append(dict(base, name=name + "/float", precision="float", seconds=float_seconds,
+                            max_relative_error=max_relative_error(float_log, exact_log),
+                            underflowed_levels=int(np.sum(np.isfinite(exact_log) & (p == 0))),
+                            total_probability_error=abs(float(p.sum()) - 1.0)))
+        records.append(dict(base, name=name + "/log", precision="log", seconds=log_seconds,
+                            max_relative_error=max_relative_error(log_p, exact_log),
+                            underflowed_levels=0,
+                            total_probability_error=abs(float(np.exp(log_p).sum()) - 1.0)))
+        records.append(dict(base, name=name + "/exact", precision="exact", seconds=exact_seconds,
+                            max_relative_error=0.0, underflowed_levels=0,
+                            total_probability_error=0.0))
+    return records
+
+
+def reference_distribution(level_count, start_level, upgrade_probabilities, n):
+    """原始的逐级动态规划（纯 Python），作为所有快速路径的参考"""
+    p = [0.0] * level_count
+    p[start_level-1] = 1.0
+    for _ in range(n):
+        new_p = [0.0] * level_count
+        for i in range(level_count):
+            if i < level_count - 1 and upgrade_probabilities[i] > 0:
+                new_p[i] += p[i] * (1 - upgrade_probabilities[i])
+                new_p[i+1] += p[i] * upgrade_probabilities[i]
+            else:
+                new_p[i] += p[i]
+        p = new_p
+    return np.array(p)
+
+
+def random_upgrade_probabilities(rng, level_count):
+    """生成测试用的升级概率，包含0和1等边界值"""
+    q = rng.uniform(0.001, 0.999, level_count - 1)
+    q[rng.random(level_count - 1) < 0.1] = 0.0
+    q[rng.random(level_count - 1) < 0.05] = 1.0
+    return q
+
+
+def estimated_seconds(level_count, n):
+    """按引擎的开销模型估计 compute_distribution 的耗时（开销单位约为 3ns）"""
+    method = chest_engine.choose_method(level_count, n)
+    if method == "matrix":
+        units = 2 * n.bit_length() * (level_count ** 3 / chest_engine._MATMUL_FLOPS_PER_UNIT
+                                      + chest_engine._MATMUL_OVERHEAD)
+    else:
+        units = n * (chest_engine._STEP_OVERHEAD + level_count)
+    return units * 3e-9
+
+
+def benchmark_engine(args):
+    """单个配置：等级数量 5~10000，升级次数 1~10⁷"""
+    rng = np.random.default_rng(0)
+    records = []
+    for level_count in (5, 50, 500, 10000):
+        q = random_upgrade_probabilities(rng, level_count)
+        for n in (1, 100, 10_000, 10_000_000):
+            name = f"engine/L{level_count}/n{n}"
+            record = {"suite": "engine", "name": name, "levels": level_count, "n": n,
+                      "method": chest_engine.choose_method(level_count, n)}
+            # 估计耗时超过上限的组合跳过，避免一次运行花费数小时
+            if estimated_seconds(level_count, n) > args.max_seconds:
+                records.append(dict(record, skipped="estimated time exceeds --max-seconds"))
+                continue
+            seconds, _ = time_call(lambda: chest_engine.compute_distribution(level_count, 1, q, n),
+                                   args.repeat)
+            records.append(dict(record, seconds=seconds))
+    return records
+
+
+def benchmark_batch(args):
+    """批量接口：不同批量大小，统一和各不相同的升级次数"""
+    rng = np.random.default_rng(1)
+    records = []
+    level_count = 5
+    for batch in (1_000, 10_000, 100_000, 1_000_000):
+        Q = rng.random((batch, level_count - 1))
+        for label, ns in (("n100", 100), ("n_mixed", rng.integers(0, 10_000, batch))):
+            seconds, _ = time_call(lambda: chest_engine.compute_distribution_batch(Q, 1, ns),
+                                   args.repeat)
+            records.append({"suite": "batch", "name": f"batch/B{batch}/{label}", "batch": batch,
+                            "levels": level_count, "seconds": seconds,
+                            "configs_per_second": batch / seconds if seconds else math.inf})
+    return records
+
+
+def benchmark_trajectory(args):
+    """完整轨迹输出"""
+    rng = np.random.default_rng(2)
+    records = []
+    for level_count, n in ((5, 1_000_000), (50, 100_000), (500, 10_000)):
+        q = random_upgrade_probabilities(rng, level_count)
+        seconds, _ = time_call(lambda: chest_engine.compute_trajectory(level_count, 1, q, n), args.repeat)
+        records.append({"suite": "trajectory", "name": f"trajectory/L{level_count}/n{n}",
+                        "levels": level_count, "n": n, "seconds": seconds})
+    return records
+
+
+def _chart_harness():
+    """在 Agg 后端上创建只含图表部分的 ChestCalculator，不需要显示器"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    import chest_probability_calculator
+    import chest_profiling
+
+    chest_probability_calculator.configure_fonts()
+    app = chest_probability_calculator.ChestCalculator.__new__(chest_probability_calculator.ChestCalculator)
+    app.language = "en"
+    app.instrumentation = chest_profiling.Instrumentation()
+    app.fig = Figure(figsize=(6, 5))
+    app.ax = app.fig.add_subplot()
+    app.canvas = FigureCanvasAgg(app.fig)
+    app.chart_key = None
+    app.chart_bars = []
+    app.chart_steps = None
+    app.chart_labels = []
+    return app
+
+
+def benchmark_render(args):
+    """图表刷新：首次构建和原位更新（Agg 后端）"""
+    app = _chart_harness()
+    rng = np.random.default_rng(3)
+    records = []
+    for level_count in (5, 50, 500, 10000):
+        p = rng.dirichlet(np.ones(level_count))
+
+        def build():
+            app.chart_key = None
+            app.update_chart(p)
+            app.canvas.draw()
+
+        def update():
+            app.update_chart(p[::-1])
+            app.canvas.draw()
+
+        for label, func in (("build", build), ("update", update)):
+            seconds, _ = time_call(func, args.repeat)
+            records.append({"suite": "render", "name": f"render/L{level_count}/{label}",
+                            "levels": level_count, "seconds": seconds})
+    return records
+
+
+def benchmark_widgets(args):
+    """update_level_inputs 的重建耗时；需要可用的显示器"""
+    import tkinter as tk
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        return [{"suite": "widgets", "name": "widgets/update_level_inputs", "skipped": str(e)}]
+
+    import chest_probability_calculator
+    records = []
+    try:
+        root.withdraw()
+        app = chest_probability_calculator.ChestCalculator(root)
+        for level_count in (5, 50, 500, 5000):
+            app.level_count_var.set(level_count)
+            seconds, _ = time_call(lambda: (app.update_level_inputs(), root.update_idletasks()),
+                                   args.repeat)
+            records.append({"suite": "widgets", "name": f"widgets/update_level_inputs/L{level_count}",
+                            "levels": level_count, "seconds": seconds})
+    finally:
+        root.destroy()
+    return records
+
+
+def benchmark_startup(args):
+    """冷启动：模块导入耗时，以及到第一帧可交互的时间（需要显示器）"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    import_script = ("import sys, time; start = time.perf_counter(); import chest_probability_calculator; "
+                     "print(time.perf_counter() - start, 'matplotlib' in sys.modules)")
+    best = None
+    for _ in range(args.repeat):
+        out = subprocess.run([sys.executable, "-c", import_script], cwd=here,
+                             capture_output=True, text=True, check=True).stdout.split()
+        seconds = float(out[0])
+        best = seconds if best is None else min(best, seconds)
+    records = [{"suite": "startup", "name": "startup/import", "seconds": best,
+                "matplotlib_loaded": out[1] == "True"}]
+
+    name = "startup/first_frame"
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        try:
+            proc = subprocess.run([sys.executable, "chest_probability_calculator.py", "--startup-time"],
+                                  cwd=here, capture_output=True, text=True, timeout=60)
+        except subprocess.TimeoutExpired:
+            return records + [{"suite": "startup", "name": name, "skipped": "timed out"}]
+        wall = time.perf_counter() - start
+        if proc.returncode != 0:
+            reason = (proc.stderr.strip().splitlines() or ["exit code %d" % proc.returncode])[-1]
+            return records + [{"suite": "startup", "name": name, "skipped": reason}]
+        if best is None or wall < best[0]:
+            best = (wall, proc.stderr)
+    # 进程内的耗时从模块开始导入算起，总耗时还包括解释器启动
+    in_process = [float(line.split()[1]) / 1000 for line in best[1].splitlines() if line.startswith("startup:")]
+    records.append({"suite": "startup", "name": name, "seconds": best[0],
+                    "in_process_seconds": in_process[0] if in_process else None})
+    return records
+
+
+def run_checks(args):
+    """各快速路径与参考动态规划的数值一致性"""
+    rng = np.random.default_rng(4)
+    worst = {}
+
+    def record(path, actual, expected):
+        error = float(np.max(np.abs(np.asarray(actual) - np.asarray(expected)))) if np.size(expected) else 0.0
+        worst[path] = max(worst.get(path, 0.0), error)
+
+    for _ in range(args.check_cases):
+        level_count = int(rng.integers(2, 12))
+        start_level = int(rng.integers(1, level_count + 1))
+        n = int(rng.integers(0, 150))
+        q = random_upgrade_probabilities(rng, level_count)
+        expected = reference_distribution(level_count, start_level, q, n)
+
+        for method in ("iterative", "matrix"):
+            record(f"distribution/{method}",
+                   chest_engine.compute_distribution(level_count, start_level, q, n, method), expected)
+            record(f"log/{method}", np.exp(
+                chest_engine.compute_log_distribution(level_count, start_level, q, n, method)), expected)
+            record(f"batch/{method}", chest_engine.compute_distribution_batch(
+                q[None, :], start_level, n, method=method)[0], expected)
+            record(f"trajectory/{method}", chest_engine.compute_trajectory(
+                level_count, start_level, q, n, method)[-1], expected)
+            record(f"jacobian/{method}", chest_engine.compute_distribution_jacobian(
+                level_count, start_level, q, n, method)[0], expected)
+            record(f"transition_model/{method}", chest_engine.build_transition_model(
+                level_count, q).distribution(start_level, n, method), expected)
+        if n <= 40:
+            record("exact", chest_engine.compute_distribution(
+                level_count, start_level, q, n, precision="exact"), expected)
+
+        # 缓存从较小 n 的结果继续计算
+        cache = chest_engine.DistributionCache()
+        cache.get(level_count, start_level, q, n // 2)
+        record("cache/prefix", cache.get(level_count, start_level, q, n), expected)
+
+        # 首达概率等于分布中不低于目标等级的概率之和
+        target = int(rng.integers(1, level_count + 1))
+        record("hitting_time_cdf", chest_engine.hitting_time_cdf(
+            level_count, start_level, q, n, target), expected[target-1:].sum())
+
+    # 批量接口中每行的初始等级和升级次数各不相同
+    level_count = 6
+    Q = np.array([random_upgrade_probabilities(rng, level_count) for _ in range(200)])
+    starts = rng.integers(1, level_count + 1, 200)
+    ns = rng.integers(0, 100, 200)
+    expected = np.array([reference_distribution(level_count, int(s), q, int(n))
+                         for q, s, n in zip(Q, starts, ns)])
+    for method in ("iterative", "matrix"):
+        record(f"batch_mixed/{method}", chest_engine.compute_distribution_batch(
+            Q, starts, ns, chunk_size=37, method=method), expected)
+
+    # 极小的升级概率：模拟中几何分布的抽样会饱和，经验分布应与精确分布一致
+    for level_count, q, n in [(3, [1e-30, 0.5], 10), (3, [1e-300, 1e-300], 10**6)] + [
+            (level_count, [chance] * (level_count - 1), n)
+            for level_count, chance, n in PRECISION_CASES if chance * n < args.tolerance]:
+        record("simulation/tiny", chest_simulation.simulate_distribution(
+            level_count, 1, q, n, 100_000, seed=1).distribution,
+            chest_engine.compute_distribution(level_count, 1, q, n))
+
+    return [{"suite": "check", "name": f"check/{path}", "max_abs_error": error,
+             "passed": error <= args.tolerance}
+            for path, error in sorted(worst.items())]
+
+
+SUITES = {
+    "engine": benchmark_engine,
+    "batch": benchmark_batch,
+    "trajectory": benchmark_trajectory,
+    "render": benchmark_render,
+    "widgets": benchmark_widgets,
+    "startup": benchmark_startup,
+    "precision": lambda args: benchmark_precision(repeat=args.repeat),
+    "check": run_checks,
+}
+
+
+def compare_with_baseline(records, baseline, threshold):
+    """与基线比较，返回耗时超过基线 (1+threshold) 倍的记录"""
+    previous = {record["name"]: record for record in baseline.get("results", [])
+                if "seconds" in record}
+    regressions = []
+    for record in records:
+        old = previous.get(record.get("name"))
+        if old is None or "seconds" not in record or old["seconds"] <= 0:
+            continue
+        ratio = record["seconds"] / old["seconds"]
+        record["baseline_seconds"] = old["seconds"]
+        record["ratio"] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(record)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="宝箱概率引擎基准 / Chest engine benchmarks")
+    parser.add_argument("suites", nargs="*",
+                        help=f"基准类别，默认全部 / benchmark suites (default: all): {', '.join(SUITES)}")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数 / repetitions")
+    parser.add_argument("--max-seconds", type=float, default=30.0,
+                        help="估计耗时超过此值的组合跳过 / skip cases estimated to take longer")
+    parser.add_argument("--output", help="把结果写入 JSON 文件 / write results to a JSON file")
+    parser.add_argument("--baseline", help="与基线 JSON 比较 / compare against a baseline JSON")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="判定变慢的相对阈值 / relative slowdown flagged as regression")
+    parser.add_argument("--tolerance", type=float, default=1e-9,
+                        help="数值一致性检查的容差 / tolerance for agreement checks")
+    parser.add_argument("--check-cases", type=int, default=200,
+                        help="数值一致性检查的随机配置数 / random configs for agreement checks")
+    args = parser.parse_args(argv)
+    unknown = [suite for suite in args.suites if suite not in SUITES]
+    if unknown:
+        parser.error(f"未知的基准类别 / unknown suite: {', '.join(unknown)}")
+
+    records = []
+    for suite in args.suites or list(SUITES):
+        records.extend(SUITES[suite](args))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+        },
+        "results": records,
+    }
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_with_baseline(records, json.load(f), args.threshold)
+        report["regressions"] = [record["name"] for record in regressions]
+        for record in regressions:
+            print(f"变慢 / regression: {record['name']} {record['baseline_seconds']:.4g}s -> "
+                  f"{record['seconds']:.4g}s ({record['ratio']:.2f}x)", file=sys.stderr)
+        if regressions:
+            status = 1
+
+    failures = [record["name"] for record in records if record.get("passed") is False]
+    for name in failures:
+        print(f"数值不一致 / mismatch: {name}", file=sys.stderr)
+    if failures:
+        status = 1
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
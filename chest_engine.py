@@ -0,0 +1,1196 @@
+"""宝箱概率计算引擎 / Chest probability engine
+
+只依赖 NumPy，不导入 tkinter 或 matplotlib，可在无界面的计算节点上直接使用。
+"""
+import bisect
+import itertools
+import threading
+from collections import OrderedDict, namedtuple
+from fractions import Fraction
+
+import numpy as np
+
+# 求解方法："auto" 根据估算的开销在逐步迭代和矩阵快速幂之间自动选择
+METHODS = ("auto", "iterative", "matrix")
+
+# 数值精度："float" 普通浮点，"log" 对数空间（保持极小概率的相对精度），"exact" 有理数精确计算
+PRECISIONS = ("float", "log", "exact")
+
+# 开销模型（单位约为 3ns，按 NumPy 实测标定）：
+# 逐步迭代每步有固定的调用开销，矩阵乘法为 O(L³)
+_STEP_OVERHEAD = 1000
+_MATMUL_OVERHEAD = 3000
+_MATMUL_FLOPS_PER_UNIT = 75
+# 对数空间的开销模型（同样的单位）：对数矩阵乘法没有 BLAS 可用，
+# 每个 L³ 项都要做一次 exp，远比浮点矩阵乘法昂贵
+_LOG_STEP_OVERHEAD = 600
+_LOG_STEP_PER_LEVEL = 8
+_LOG_MATMUL_OVERHEAD = 40000
+_LOG_MATMUL_UNITS_PER_TERM = 4
+
+# 批量计算时每块的行数，以及矩阵快速幂单块转移矩阵占用的内存上限（字节）
+DEFAULT_CHUNK_SIZE = 65536
+_MATRIX_CHUNK_BYTES = 64 * 1024 * 1024
+
+# 轨迹计算时每块缓冲的字节数；等级数不超过此值时用预先计算的矩阵幂整块计算
+_TRAJECTORY_BLOCK_BYTES = 16 * 1024 * 1024
+_TRAJECTORY_MATRIX_MAX_LEVELS = 32
+
+# 逐步迭代时每隔多少步报告一次进度
+PROGRESS_INTERVAL = 4096
+
+
+class CalculationCancelled(Exception):
+    """进度回调抛出此异常以取消正在进行的计算"""
+
+
+def parse_percentage(value_str):
+    """解析百分比输入，支持带%号和不带%号的输入"""
+    try:
+        # 去除空格
+        value_str = value_str.strip()
+
+        # 如果以%结尾，去掉%号
+        if value_str.endswith('%'):
+            value_str = value_str[:-1]
+
+        # 转换为浮点数
+        value = float(value_str)
+
+        # 如果值大于1，假设是百分比格式，除以100
+        if value > 1:
+            value = value / 100.0
+
+        return value
+    except ValueError:
+        raise ValueError(f"无法解析的概率值 / Cannot parse probability value: {value_str}")
+
+
+def parse_percentages(values, validate=True):
+    """批量解析百分比字符串，规则与 parse_percentage 相同（大于1视为百分比）
+
+    返回 (概率数组, 错误列表)。错误列表的元素为 (行号, 原始值, 错误信息)，
+    出错的行在数组中为 nan。validate 为 True 时同时检查概率是否在0到1之间。
+    """
+    raw = np.asarray(values, dtype=str).ravel()
+    # 去除空格，再去掉末尾的一个%号
+    stripped = np.char.rstrip(np.char.strip(raw), "%")
+    removed = np.char.str_len(np.char.strip(raw)) - np.char.str_len(stripped)
+
+    try:
+        result = stripped.astype(np.float64)
+        bad = np.zeros(raw.size, dtype=bool)
+    except ValueError:
+        # 快速路径失败时逐个转换，找出无法解析的行
+        result = np.empty(raw.size)
+        bad = np.zeros(raw.size, dtype=bool)
+        for i, text in enumerate(stripped.tolist()):
+            try:
+                result[i] = float(text)
+            except ValueError:
+                bad[i] = True
+    # 多于一个%号时 parse_percentage 同样无法解析
+    bad |= removed > 1
+    result[bad] = np.nan
+
+    # 如果值大于1，假设是百分比格式，除以100
+    result = np.where(result > 1, result / 100.0, result)
+
+    errors = [(int(i), str(raw[i]), f"无法解析的概率值 / Cannot parse probability value: {raw[i]}")
+              for i in np.flatnonzero(bad)]
+    if validate:
+        out_of_range = ~bad & ~((result >= 0) & (result <= 1))
+        errors.extend((int(i), str(raw[i]), "概率必须在0到100%之间 / "
+                       "Probability must be between 0 and 100%")
+                      for i in np.flatnonzero(out_of_range))
+        result[out_of_range] = np.nan
+        errors.sort()
+
+    return result, errors
+
+
+def iter_parse_percentages(values, chunk_size=DEFAULT_CHUNK_SIZE, validate=True):
+    """逐块解析任意可迭代的百分比字符串（例如文件的某一列），内存占用与总行数无关
+
+    依次产出 (起始行号, 概率数组, 错误列表)，错误列表中的行号为全局行号。
+    """
+    iterator = iter(values)
+    offset = 0
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        result, errors = parse_percentages(chunk, validate)
+        yield offset, result, [(offset + i, text, message) for i, text, message in errors]
+        offset += len(chunk)
+
+
+def whole_steps(steps):
+    """把升级次数转换为 int；不是整数时报错，而不是截断小数部分"""
+    try:
+        whole = int(steps)
+    except (TypeError, ValueError, OverflowError):
+        whole = None
+    if whole is None or whole != steps:
+        raise ValueError(f"升级次数必须是整数 / Upgrade times must be a whole number: {steps}")
+    return whole
+
+
+def validate_config(level_count, start_level, upgrade_probabilities, n):
+    """验证计算参数，返回升级概率数组"""
+    if level_count < 2:
+        raise ValueError("宝箱等级数量必须至少为2 / Number of chest levels must be at least 2")
+
+    if start_level < 1 or start_level > level_count:
+        raise ValueError(f"初始等级必须在1到{level_count}之间 / "
+                         f"Starting level must be between 1 and {level_count}")
+
+    if whole_steps(n) < 0:
+        raise ValueError("升级次数不能为负数 / Upgrade times cannot be negative")
+
+    q = np.asarray(upgrade_probabilities, dtype=np.float64)
+    if q.shape != (level_count - 1,):
+        raise ValueError(f"需要 {level_count - 1} 个升级概率 / "
+                         f"Expected {level_count - 1} upgrade probabilities")
+
+    bad = np.flatnonzero(~((q >= 0) & (q <= 1)))
+    if bad.size:
+        i = int(bad[0])
+        raise ValueError(f"等级 {i+1}→{i+2} 的概率必须在0到100%之间 / "
+                         f"Level {i+1}→{i+2} probability must be between 0 and 100%")
+
+    return q
+
+
+def initial_distribution(level_count, start_level):
+    """初始状态：初始等级宝箱概率为1"""
+    p = np.zeros(level_count)
+    p[start_level-1] = 1.0
+    return p
+
+
+def transition_matrix(upgrade_probabilities):
+    """构造单次升级的转移矩阵 M，满足 p_next = p @ M"""
+    q = np.asarray(upgrade_probabilities, dtype=np.float64)
+    level_count = q.size + 1
+    # 对角线为保持原等级的概率，上对角线为升级概率
+    M = np.diag(np.append(1.0 - q, 1.0))
+    idx = np.arange(level_count - 1)
+    M[idx, idx + 1] = q
+    return M
+
+
+def choose_method(level_count, steps, batch_size=1):
+    """根据开销模型选择逐步迭代或矩阵快速幂"""
+    if steps < 2:
+        return "iterative"
+    iterative_cost = steps * (_STEP_OVERHEAD + batch_size * level_count)
+    matrix_cost = 2 * steps.bit_length() * (
+        batch_size * level_count ** 3 / _MATMUL_FLOPS_PER_UNIT + _MATMUL_OVERHEAD)
+    return "matrix" if matrix_cost < iterative_cost else "iterative"
+
+
+def _choose_log_method(level_count, steps):
+    """对数空间版本的 choose_method"""
+    if steps < 2:
+        return "iterative"
+    iterative_cost = steps * (_LOG_STEP_OVERHEAD + _LOG_STEP_PER_LEVEL * level_count)
+    matrix_cost = 2 * steps.bit_length() * (
+        _LOG_MATMUL_UNITS_PER_TERM * level_count ** 3 + _LOG_MATMUL_OVERHEAD)
+    return "matrix" if matrix_cost < iterative_cost else "iterative"
+
+
+def _advance_iterative(p, q, steps, progress=None):
+    """逐步迭代：每次升级 O(L)"""
+    # 最高等级无法升级，保持概率为1
+    stay = np.append(1.0 - q, 1.0)
+
+    done = 0
+    while done < steps:
+        block = min(PROGRESS_INTERVAL, steps - done) if progress is not None else steps
+        for _ in range(block):
+            # 部分保持原等级，部分升级到下一等级
+            moved = p[:-1] * q
+            p *= stay
+            p[1:] += moved
+        done += block
+        if progress is not None:
+            progress(done, steps)
+
+    return p
+
+
+def _advance_matrix(p, q, steps, progress=None):
+    """矩阵快速幂：平方求幂，O(L³·log n)"""
+    return _apply_matrix_power(p, transition_matrix(q), steps, progress)
+
+
+def _apply_matrix_power(p, power, steps, progress=None):
+    """计算 p @ M^steps，对 M 反复平方"""
+    total = steps.bit_length()
+    while steps:
+        if steps & 1:
+            p = p @ power
+        steps >>= 1
+        if steps:
+            power = power @ power
+        if progress is not None:
+            progress(total - steps.bit_length(), total)
+    return p
+
+
+def advance_distribution(p, upgrade_probabilities, steps, method="auto", progress=None):
+    """从分布 p 出发再进行 steps 次升级，返回新的分布
+
+    progress(done, total) 在计算过程中被周期性调用，可抛出 CalculationCancelled 取消计算。
+    """
+    if method not in METHODS:
+        raise ValueError(f"未知的计算方法 / Unknown method: {method}")
+
+    q = np.asarray(upgrade_probabilities, dtype=np.float64)
+    p = np.array(p, dtype=np.float64)
+    steps = whole_steps(steps)
+
+    # 低于最低非零等级的部分永远为0，只需计算剩余的子链
+    nonzero = np.flatnonzero(p)
+    if nonzero.size == 0 or steps == 0:
+        return p
+    low = int(nonzero[0])
+    sub_p, sub_q = p[low:], q[low:]
+
+    if method == "auto":
+        method = choose_method(sub_p.size, steps)
+
+    if method == "matrix":
+        p[low:] = _advance_matrix(sub_p, sub_q, steps, progress)
+    else:
+        p[low:] = _advance_iterative(sub_p, sub_q, steps, progress)
+
+    return p
+
+
+def compute_distribution(level_count, start_level, upgrade_probabilities, n, method="auto",
+                         precision="float", progress=None):
+    """计算 n 次升级后各等级宝箱的概率分布
+
+    p[i] 表示处于第 i+1 级的概率。method 可选 "auto"、"iterative" 或 "matrix"；
+    precision 可选 "float"、"log"（对数空间递推）或 "exact"（有理数），结果都舍入为普通浮点数，
+    因此低于约 1e-308 的概率仍会下溢为0；需要这样的概率时使用 compute_log_distribution。
+    progress 只用于 "float" 精度，参见 advance_distribution。
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"未知的数值精度 / Unknown precision: {precision}")
+    if precision == "log":
+        return np.exp(compute_log_distribution(level_count, start_level, upgrade_probabilities, n, method))
+    if precision == "exact":
+        exact = compute_distribution_exact(level_count, start_level, upgrade_probabilities, n)
+        return np.array([float(value) for value in exact])
+
+    q = validate_config(level_count, start_level, upgrade_probabilities, n)
+    p = initial_distribution(level_count, start_level)
+    return advance_distribution(p, q, n, method, progress)
+
+
+def _logsumexp(a, axis):
+    """数值稳定的 log Σ exp，全为 -inf 时结果为 -inf"""
+    m = np.max(a, axis=axis, keepdims=True)
+    shift = np.where(np.isfinite(m), m, 0.0)
+    with np.errstate(divide="ignore"):
+        out = np.log(np.sum(np.exp(a - shift), axis=axis, keepdims=True)) + shift
+    return np.squeeze(out, axis=axis)
+
+
+def _log_matmul(A, B):
+    """对数空间矩阵乘法：C[i,j] = log Σ_k exp(A[i,k] + B[k,j])"""
+    if A.ndim == 1:
+        return _logsumexp(A[:, None] + B, axis=0)
+    # 按行分块，控制 (rows, L, L) 临时数组的大小
+    rows = max(1, _MATRIX_CHUNK_BYTES // (8 * B.shape[0] * B.shape[1]))
+    out = np.empty((A.shape[0], B.shape[1]))
+    for lo in range(0, A.shape[0], rows):
+        out[lo:lo+rows] = _logsumexp(A[lo:lo+rows, :, None] + B[None, :, :], axis=1)
+    return out
+
+
+def _log_transition(q):
+    """升级概率对应的对数停留概率和对数升级概率；log1p 保证极小 q 时 1-q 不丢精度"""
+    with np.errstate(divide="ignore"):
+        return np.append(np.log1p(-q), 0.0), np.log(q)
+
+
+def advance_log_distribution(logp, upgrade_probabilities, steps, method="auto"):
+    """对数空间版本的 advance_distribution，输入输出均为自然对数概率"""
+    if method not in METHODS:
+        raise ValueError(f"未知的计算方法 / Unknown method: {method}")
+
+    q = np.asarray(upgrade_probabilities, dtype=np.float64)
+    logp = np.array(logp, dtype=np.float64)
+    steps = whole_steps(steps)
+
+    # 低于最低非零等级的部分永远为0，只需计算剩余的子链
+    finite = np.flatnonzero(np.isfinite(logp))
+    if finite.size == 0 or steps == 0:
+        return logp
+    low = int(finite[0])
+    sub, sub_q = logp[low:], q[low:]
+    log_stay, log_up = _log_transition(sub_q)
+
+    if method == "auto":
+        method = _choose_log_method(sub.size, steps)
+
+    if method == "matrix":
+        level_count = sub.size
+        power = np.full((level_count, level_count), -np.inf)
+        idx = np.arange(level_count)
+        power[idx, idx] = log_stay
+        power[idx[:-1], idx[:-1] + 1] = log_up
+        while steps:
+            if steps & 1:
+                sub = _log_matmul(sub, power)
+            steps >>= 1
+            if steps:
+                power = _log_matmul(power, power)
+    else:
+        for _ in range(steps):
+            moved = sub[:-1] + log_up
+            sub = sub + log_stay
+            sub[1:] = np.logaddexp(sub[1:], moved)
+
+    logp[low:] = sub
+    return logp
+
+
+def compute_log_distribution(level_count, start_level, upgrade_probabilities, n, method="auto"):
+    """计算 n 次升级后各等级概率的自然对数
+
+    在对数空间中进行递推，极小的概率（低于 1e-300 甚至更小）也能保持相对精度，
+    不会下溢为0。概率为0的等级结果为 -inf。
+    """
+    q = validate_config(level_count, start_level, upgrade_probabilities, n)
+    with np.errstate(divide="ignore"):
+        logp = np.log(initial_distribution(level_count, start_level))
+    return advance_log_distribution(logp, q, n, method)
+
+
+def compute_distribution_exact(level_count, start_level, upgrade_probabilities, n):
+    """用有理数精确计算分布，返回 Fraction 列表
+
+    升级概率可以是字符串（如 "0.45"，按十进制精确解析）、Fraction 或浮点数。
+    计算量为 O(n·L) 次大整数运算，只适合较小的 n，主要用作其他路径的参考值。
+    """
+    q = [Fraction(value) if not isinstance(value, str) else Fraction(value.strip())
+         for value in upgrade_probabilities]
+    validate_config(level_count, start_level, [float(value) for value in q], n)
+    n = whole_steps(n)
+
+    p = [Fraction(0)] * level_count
+    p[start_level-1] = Fraction(1)
+    for _ in range(n):
+        new_p = [Fraction(0)] * level_count
+        for i in range(level_count):
+            if i < level_count - 1:
+                new_p[i] += p[i] * (1 - q[i])
+                new_p[i+1] += p[i] * q[i]
+            else:
+                new_p[i] += p[i]
+        p = new_p
+    return p
+
+
+def _whole_batch_values(values, offset, name_zh, name_en):
+    """把一块初始等级或升级次数转换为 int64；不是整数时报告全局行号，而不是截断"""
+    raw = np.asarray(values)
+    with np.errstate(invalid="ignore"):
+        whole = raw.astype(np.int64)
+    if raw.dtype.kind not in "biu":
+        bad = np.flatnonzero(whole != raw)
+        if bad.size:
+            row = offset + int(bad[0])
+            raise ValueError(f"第 {row} 行的{name_zh}必须是整数 / "
+                             f"Row {row}: {name_en} must be a whole number")
+    return whole
+
+
+def _validate_batch_chunk(q, starts, ns, offset):
+    """验证一块批量参数，出错时报告全局行号"""
+    level_count = q.shape[1] + 1
+
+    bad = np.flatnonzero(~np.all((q >= 0) & (q <= 1), axis=1))
+    if bad.size:
+        row = offset + int(bad[0])
+        raise ValueError(f"第 {row} 行的升级概率必须在0到1之间 / "
+                         f"Row {row}: upgrade probabilities must be between 0 and 1")
+
+    bad = np.flatnonzero((starts < 1) | (starts > level_count))
+    if bad.size:
+        row = offset + int(bad[0])
+        raise ValueError(f"第 {row} 行的初始等级必须在1到{level_count}之间 / "
+                         f"Row {row}: starting level must be between 1 and {level_count}")
+
+    bad = np.flatnonzero(ns < 0)
+    if bad.size:
+        row = offset + int(bad[0])
+        raise ValueError(f"第 {row} 行的升级次数不能为负数 / "
+                         f"Row {row}: upgrade times cannot be negative")
+
+
+def _batch_iterative(p, q, ns):
+    """批量逐步迭代：按升级次数分段，已完成的行以零升级概率保持不变"""
+    stay = np.ones_like(p)
+    done = 0
+    for n in np.unique(ns):
+        n = int(n)
+        # 仍需继续升级的行保留原升级概率，其余行置零
+        q_eff = np.where((ns >= n)[:, None], q, 0.0)
+        stay[:, :-1] = 1.0 - q_eff
+        for _ in range(n - done):
+            moved = p[:, :-1] * q_eff
+            p *= stay
+            p[:, 1:] += moved
+        done = n
+    return p
+
+
+def _batch_matrix(p, q, ns):
+    """批量矩阵快速幂：每行按自己的升级次数的二进制位乘上对应的幂"""
+    batch, level_count = p.shape
+    idx = np.arange(level_count - 1)
+    power = np.zeros((batch, level_count, level_count))
+    power[:, idx, idx] = 1.0 - q
+    power[:, idx, idx + 1] = q
+    power[:, -1, -1] = 1.0
+
+    ns = ns.copy()
+    while True:
+        rows = np.flatnonzero(ns & 1)
+        if rows.size == batch:
+            p = np.matmul(p[:, None, :], power)[:, 0, :]
+        elif rows.size:
+            p[rows] = np.matmul(p[rows, None, :], power[rows])[:, 0, :]
+        ns >>= 1
+        if not ns.any():
+            return p
+        power = np.matmul(power, power)
+
+
+def _batch_chunk(q, starts, ns, method):
+    """计算一块批量参数的分布"""
+    batch, level_count = q.shape[0], q.shape[1] + 1
+    out = np.zeros((batch, level_count))
+    out[np.arange(batch), starts - 1] = 1.0
+    if batch == 0 or not ns.any():
+        return out
+
+    # 低于本块最低初始等级的部分永远为0，只需计算剩余的子链
+    low = int(starts.min()) - 1
+    p, sub_q = out[:, low:], q[:, low:]
+    sub_levels = level_count - low
+
+    if method == "auto":
+        method = choose_method(sub_levels, int(ns.max()), batch)
+
+    if method == "matrix":
+        # 控制每次同时存放的转移矩阵数量
+        rows = max(1, _MATRIX_CHUNK_BYTES // (8 * sub_levels * sub_levels))
+        for lo in range(0, batch, rows):
+            hi = lo + rows
+            p[lo:hi] = _batch_matrix(p[lo:hi], sub_q[lo:hi], ns[lo:hi])
+    else:
+        p[:] = _batch_iterative(p, sub_q, ns)
+
+    return out
+
+
+def iter_distribution_batch(upgrade_probabilities, start_levels, n,
+                            chunk_size=DEFAULT_CHUNK_SIZE, method="auto"):
+    """逐块计算批量分布，依次产出 (起始行号, 结果块)
+
+    upgrade_probabilities 的形状为 (B, L-1)，可以是 np.memmap；
+    start_levels 和 n 可以是标量或长度为 B 的数组。每次只把一块数据读入内存。
+    """
+    if method not in METHODS:
+        raise ValueError(f"未知的计算方法 / Unknown method: {method}")
+
+    Q = np.asarray(upgrade_probabilities)
+    if Q.ndim != 2 or Q.shape[1] < 1:
+        raise ValueError("升级概率必须是形状为 (B, L-1) 的数组 / "
+                         "Upgrade probabilities must have shape (B, L-1)")
+    batch = Q.shape[0]
+    starts = np.broadcast_to(np.asarray(start_levels), (batch,))
+    ns = np.broadcast_to(np.asarray(n), (batch,))
+
+    for lo in range(0, batch, chunk_size):
+        hi = min(lo + chunk_size, batch)
+        q = np.asarray(Q[lo:hi], dtype=np.float64)
+        s = _whole_batch_values(starts[lo:hi], lo, "初始等级", "starting level")
+        k = _whole_batch_values(ns[lo:hi], lo, "升级次数", "upgrade times")
+        _validate_batch_chunk(q, s, k, lo)
+        yield lo, _batch_chunk(q, s, k, method)
+
+
+def compute_distribution_batch(upgrade_probabilities, start_levels, n,
+                               chunk_size=DEFAULT_CHUNK_SIZE, method="auto", out=None):
+    """批量计算分布，返回形状为 (B, L) 的结果矩阵
+
+    out 可以传入预先分配的数组（例如 np.memmap），结果按块写入。
+    """
+    Q = np.asarray(upgrade_probabilities)
+    if out is None:
+        out = np.empty((Q.shape[0], Q.shape[1] + 1) if Q.ndim == 2 else (0, 0))
+
+    for lo, chunk in iter_distribution_batch(Q, start_levels, n, chunk_size, method):
+        out[lo:lo + chunk.shape[0]] = chunk
+
+    return out
+
+
+def _trajectory_powers(q, count):
+    """依次计算 M¹..M^count，返回形状为 (count, L, L) 的数组"""
+    level_count = q.size + 1
+    stay = np.append(1.0 - q, 1.0)
+    powers = np.empty((count, level_count, level_count))
+    current = np.eye(level_count)
+    for j in range(count):
+        # 右乘双对角矩阵 M：每列保持一部分，并从左侧一列升级而来
+        moved = current[:, :-1] * q
+        current = current * stay
+        current[:, 1:] += moved
+        powers[j] = current
+    return powers
+
+
+def compute_trajectory(level_count, start_level, upgrade_probabilities, n,
+                       method="auto", mmap_path=None):
+    """计算第 0..n 次升级后的全部分布，返回形状为 (n+1, L) 的数组
+
+    第 t 行为 t 次升级后的分布。给出 mmap_path 时结果直接写入磁盘上的
+    .npy 文件（np.lib.format.open_memmap），内存中只保留一块缓冲。
+    """
+    if method not in METHODS:
+        raise ValueError(f"未知的计算方法 / Unknown method: {method}")
+    q = validate_config(level_count, start_level, upgrade_probabilities, n)
+    n = whole_steps(n)
+
+    shape = (n + 1, level_count)
+    if mmap_path is None:
+        out = np.zeros(shape)
+    else:
+        # 新建的 .npy 文件内容全为0
+        out = np.lib.format.open_memmap(mmap_path, mode="w+", dtype=np.float64, shape=shape)
+    out[0, start_level-1] = 1.0
+
+    # 低于初始等级的列永远为0，只需计算剩余的子链
+    low = start_level - 1
+    sub_q = q[low:]
+    sub_levels = level_count - low
+    p = out[0, low:].copy()
+
+    if method == "auto":
+        method = "matrix" if sub_levels <= _TRAJECTORY_MATRIX_MAX_LEVELS else "iterative"
+
+    if method == "matrix":
+        block = max(1, min(n, _TRAJECTORY_BLOCK_BYTES // (8 * sub_levels * sub_levels)))
+        powers = _trajectory_powers(sub_q, block)
+    else:
+        block = max(1, min(n, _TRAJECTORY_BLOCK_BYTES // (8 * sub_levels)))
+        stay = np.append(1.0 - sub_q, 1.0)
+        buffer = np.empty((block, sub_levels))
+
+    t = 0
+    while t < n:
+        k = min(block, n - t)
+        if method == "matrix":
+            # 第 t+j 行 = 第 t 行 @ M^j
+            rows = np.matmul(p, powers[:k])
+        else:
+            rows = buffer[:k]
+            for j in range(k):
+                moved = p[:-1] * sub_q
+                p *= stay
+                p[1:] += moved
+                rows[j] = p
+        out[t+1:t+1+k, low:] = rows
+        p = rows[-1].copy()
+        t += k
+
+    if mmap_path is not None:
+        out.flush()
+    return out
+
+
+def _hitting_chain(level_count, start_level, upgrade_probabilities, target_level):
+    """取出从初始等级到目标等级路径上的升级概率"""
+    q = validate_config(level_count, start_level, upgrade_probabilities, 0)
+    if target_level is None:
+        target_level = level_count
+    if target_level < 1 or target_level > level_count:
+        raise ValueError(f"目标等级必须在1到{level_count}之间 / "
+                         f"Target level must be between 1 and {level_count}")
+    # 已经达到目标等级时路径为空，首达时间为0
+    return q[start_level-1:max(target_level, start_level)-1]
+
+
+def hitting_time_mean(level_count, start_level, upgrade_probabilities, target_level=None):
+    """到达目标等级（默认最高等级）所需升级次数的期望
+
+    每一级停留的次数服从几何分布，期望为 Σ 1/q。路径上有概率为0的等级时返回 inf。
+    """
+    q = _hitting_chain(level_count, start_level, upgrade_probabilities, target_level)
+    if np.any(q == 0):
+        return float("inf")
+    return float(np.sum(1.0 / q))
+
+
+def hitting_time_variance(level_count, start_level, upgrade_probabilities, target_level=None):
+    """到达目标等级所需升级次数的方差：Σ (1-q)/q²"""
+    q = _hitting_chain(level_count, start_level, upgrade_probabilities, target_level)
+    if np.any(q == 0):
+        return float("inf")
+    return float(np.sum((1.0 - q) / q ** 2))
+
+
+def hitting_time_cdf(level_count, start_level, upgrade_probabilities, n, target_level=None):
+    """n 次升级内到达目标等级的概率，即 P(等级 ≥ 目标等级)"""
+    if whole_steps(n) < 0:
+        raise ValueError("升级次数不能为负数 / Upgrade times cannot be negative")
+    q = _hitting_chain(level_count, start_level, upgrade_probabilities, target_level)
+    # 把目标等级视为吸收态，只需计算路径上的子链
+    p = initial_distribution(q.size + 1, 1)
+    return float(advance_distribution(p, q, n)[-1])
+
+
+def hitting_time_quantile(level_count, start_level, upgrade_probabilities, x, target_level=None):
+    """满足 P(等级 ≥ 目标等级) ≥ x 的最小升级次数
+
+    先对转移矩阵反复平方找到上界，再从高位到低位逐位确定答案（倍增法），
+    共 O(L³·log n)。x 无法达到时返回 None。
+    x = 1 只有在路径上的升级概率全为1时才能达到（答案为路径长度），否则首达时间
+    没有上界；浮点的累积概率会舍入到 1.0，不能用来判断。x 非常接近1时结果同样受舍入影响。
+    """
+    if not 0 <= x <= 1:
+        raise ValueError("分位数必须在0到1之间 / Quantile must be between 0 and 1")
+    q = _hitting_chain(level_count, start_level, upgrade_probabilities, target_level)
+    if q.size == 0 or x == 0:
+        return 0
+    if np.any(q == 0):
+        return None
+    if x == 1:
+        return q.size if np.all(q == 1) else None
+
+    # powers[j] = M^(2^j)，直到 2^j 次升级内达到目标的概率不小于 x
+    p = initial_distribution(q.size + 1, 1)
+    powers = [transition_matrix(q)]
+    while (p @ powers[-1])[-1] < x:
+        if len(powers) >= 63:
+            return None
+        powers.append(powers[-1] @ powers[-1])
+
+    # 保持 P(T ≤ steps) < x，从高位到低位尽量增加 steps
+    steps = 0
+    for j in range(len(powers) - 1, -1, -1):
+        candidate = p @ powers[j]
+        if candidate[-1] < x:
+            p = candidate
+            steps += 1 << j
+    return steps + 1
+
+
+def _jacobian_iterative(p, q, steps):
+    """前向模式逐步传播 J = ∂p/∂q，每步 O(L²)"""
+    level_count = p.size
+    idx = np.arange(level_count - 1)
+    stay = np.append(1.0 - q, 1.0)
+    J = np.zeros((level_count, level_count - 1))
+    for _ in range(steps):
+        # 对递推 new[i] = p[i]·(1-q[i]) + p[i-1]·q[i-1] 求导
+        moved = J[:-1] * q[:, None]
+        J *= stay[:, None]
+        J[1:] += moved
+        J[idx, idx] -= p[:-1]
+        J[idx + 1, idx] += p[:-1]
+
+        moved = p[:-1] * q
+        p *= stay
+        p[1:] += moved
+    return p, J
+
+
+def _jacobian_matrix(p, q, steps):
+    """矩阵快速幂同时传播 M^k 对每个升级概率的导数，O(L⁴·log n)"""
+    level_count = p.size
+    idx = np.arange(level_count - 1)
+    power = transition_matrix(q)
+    # d_power[j] = ∂M/∂q_j：只有 (j, j) 为 -1，(j, j+1) 为 1
+    d_power = np.zeros((level_count - 1, level_count, level_count))
+    d_power[idx, idx, idx] = -1.0
+    d_power[idx, idx, idx + 1] = 1.0
+    # dv[j] = ∂v/∂q_j
+    dv = np.zeros((level_count - 1, level_count))
+
+    while steps:
+        if steps & 1:
+            # d(v·P) = dv·P + v·dP
+            dv = dv @ power + np.matmul(p, d_power)
+            p = p @ power
+        steps >>= 1
+        if steps:
+            # d(P·P) = dP·P + P·dP
+            d_power = d_power @ power + np.matmul(power, d_power)
+            power = power @ power
+    return p, dv.T
+
+
+def compute_distribution_jacobian(level_count, start_level, upgrade_probabilities, n, method="auto"):
+    """计算分布及其对各升级概率的雅可比矩阵
+
+    返回 (p, J)，J[i, j] = ∂p[i]/∂upgrade_probabilities[j]，形状为 (L, L-1)。
+    导数与分布在同一遍递推中前向传播，不需要额外的有限差分运行。
+    低于初始等级的升级概率不影响结果，对应的列为0。
+    """
+    if method not in METHODS:
+        raise ValueError(f"未知的计算方法 / Unknown method: {method}")
+    q = validate_config(level_count, start_level, upgrade_probabilities, n)
+    p = initial_distribution(level_count, start_level)
+    J = np.zeros((level_count, level_count - 1))
+
+    # 只需计算从初始等级开始的子链
+    low = start_level - 1
+    if low == level_count - 1 or n == 0:
+        return p, J
+    sub_levels = level_count - low
+
+    if method == "auto":
+        iterative_cost = n * (_STEP_OVERHEAD + sub_levels * sub_levels)
+        matrix_cost = 2 * int(n).bit_length() * (
+            sub_levels ** 4 / _MATMUL_FLOPS_PER_UNIT + _MATMUL_OVERHEAD)
+        method = "matrix" if matrix_cost < iterative_cost else "iterative"
+
+    if method == "matrix":
+        sub_p, sub_J = _jacobian_matrix(p[low:], q[low:], int(n))
+    else:
+        sub_p, sub_J = _jacobian_iterative(p[low:].copy(), q[low:], int(n))
+    p[low:] = sub_p
+    J[low:, low:] = sub_J
+    return p, J
+
+
+# 拟合时阻尼矩阵对角元的下限（相对于对角元的平均值），以及判定下降停滞的相对降幅
+_FIT_DAMPING_FLOOR = 1e-3
+_FIT_STALL_RATIO = 1e-12
+
+FitResult = namedtuple("FitResult", ["upgrade_probabilities", "distribution", "max_error", "iterations", "converged"])
+
+
+def _geometric_filter(arrival, stay, block=128):
+    """计算 s[m] = stay·s[m-1] + arrival[m]
+
+    按块计算：块内是下三角 Toeplitz 矩阵乘法，块间只传递上一块的末值，
+    所有项非负，没有相消误差。
+    """
+    k = np.arange(block)
+    kernel = np.tril(stay ** np.maximum(k[:, None] - k[None, :], 0))
+    carry = stay ** (k + 1)
+    size = arrival.size
+    blocks = np.zeros(-(-size // block) * block)
+    blocks[:size] = arrival
+    out = blocks.reshape(-1, block) @ kernel.T
+    for b in range(1, len(out)):
+        out[b] += out[b - 1, -1] * carry
+    return out.ravel()[:size]
+
+
+def _fit_initial_guess(target, start_level, n):
+    """逐级求解升级概率，作为拟合的初始值
+
+    第 j 级的最终概率只取决于 q[low..j]：到达第 j 级的时刻分布 a 由更低的等级决定，
+    P(第 j 级) = Σ_m a[m]·(1-q[j])^(n-m) 随 q[j] 单调递减，可以二分求解。
+    某一级的目标超出可达范围时取区间端点，之后由迭代修正。
+    """
+    level_count = target.size
+    q = np.full(level_count - 1, 0.5)
+    exponents = np.arange(n, -1, -1, dtype=np.float64)
+    # arrival[m] 为第 m 步到达当前等级的概率
+    arrival = np.zeros(n + 1)
+    arrival[0] = 1.0
+    for j in range(start_level - 1, level_count - 1):
+        lo, hi = 0.0, 1.0
+        # 50 次二分精度约 1e-15，mid 不会取到端点，log1p 不会出现 log(0)
+        for _ in range(50):
+            mid = (lo + hi) / 2
+            if arrival @ np.exp(exponents * np.log1p(-mid)) > target[j]:
+                lo = mid
+            else:
+                hi = mid
+        q[j] = (lo + hi) / 2
+        stay = _geometric_filter(arrival, 1 - q[j])
+        arrival[0] = 0.0
+        arrival[1:] = stay[:-1] * q[j]
+    return q
+
+
+def fit_upgrade_probabilities(target, start_level, n, initial=None, weights=None, max_iter=50, tol=1e-10):
+    """反解升级概率，使 n 次升级后的分布尽量接近目标分布
+
+    最小化 Σ w[i]·(p[i] - target[i])²。weights 默认为 1/target（卡方距离），
+    使概率很小的等级也能被准确拟合；否则绝对误差下问题严重病态。
+    initial 默认由目标分布逐级求解（_fit_initial_guess），目标可达时已是精确解；
+    之后用 Levenberg-Marquardt 迭代，每次迭代用 compute_distribution_jacobian
+    一遍得到分布和雅可比矩阵，并把概率限制在 [0, 1] 内。
+    低于初始等级的升级概率不影响结果，保持为初始值。
+
+    converged 表示 max_error（各等级概率的最大绝对误差）不超过 tol，
+    与 weights 无关；目标不可达时返回加权误差的局部最优，converged 为 False。
+    """
+    target = np.asarray(target, dtype=np.float64)
+    level_count = target.size
+    low = start_level - 1
+    if initial is None:
+        q = np.full(level_count - 1, 0.5)
+    else:
+        q = np.array(initial, dtype=np.float64)
+    validate_config(level_count, start_level, q, n)
+    n = whole_steps(n)
+    if initial is None:
+        q = _fit_initial_guess(target, start_level, n)
+    if weights is None:
+        weights = 1.0 / (target + 1e-12)
+    scale = np.sqrt(np.asarray(weights, dtype=np.float64))
+
+    def evaluate(q):
+        p, J = compute_distribution_jacobian(level_count, start_level, q, n)
+        residual = (p - target) * scale
+        return p, J[:, low:] * scale[:, None], residual, float(residual @ residual)
+
+    def max_error(p):
+        return float(np.max(np.abs(p - target)))
+
+    def result(q, p, iterations):
+        error = max_error(p)
+        return FitResult(q, p, error, iterations, error <= tol)
+
+    damping = 1e-3
+    p, A, residual, cost = evaluate(q)
+
+    for iteration in range(1, max_iter + 1):
+        if max_error(p) <= tol:
+            return result(q, p, iteration - 1)
+
+        gradient = A.T @ residual
+        normal = A.T @ A
+        # 初始值几乎到达不了的等级 diag(JᵀJ) 接近0，阻尼按平均尺度设下限，
+        # 否则这些方向上的步长为0，阻尼只能不断增大
+        diagonal = np.diag(normal)
+        diagonal = np.maximum(diagonal, _FIT_DAMPING_FLOOR * diagonal.mean() + 1e-300)
+        while True:
+            # 阻尼的正规方程：(JᵀJ + λ·D) δ = -Jᵀr
+            system = normal + damping * np.diag(diagonal)
+            step = np.linalg.lstsq(system, -gradient, rcond=None)[0]
+            candidate = q.copy()
+            candidate[low:] = np.clip(q[low:] + step, 0.0, 1.0)
+            new_p, new_A, new_residual, new_cost = evaluate(candidate)
+            if new_cost < cost:
+                damping = max(damping / 10, 1e-12)
+                break
+            damping *= 10
+            if damping > 1e12:
+                # 无法继续下降，已到达局部最优
+                return result(q, p, iteration)
+
+        stalled = cost - new_cost <= _FIT_STALL_RATIO * cost
+        q, p, A, residual, cost = candidate, new_p, new_A, new_residual, new_cost
+        if stalled:
+            # 下降已停滞，只有误差足够小时才算收敛
+            return result(q, p, iteration)
+
+    return result(q, p, max_iter)
+
+
+class DistributionCache:
+    """带 LRU 淘汰的分布缓存
+
+    以 (等级数量, 初始等级, 升级概率, n) 为键。未命中时如果缓存了同一配置
+    较小 n 的结果，则从该状态继续计算剩余的升级次数，而不是从第0步开始。
+    """
+
+    def __init__(self, maxsize=256, method="auto"):
+        if maxsize < 1:
+            raise ValueError("缓存大小必须至少为1 / Cache size must be at least 1")
+        self.maxsize = maxsize
+        self.method = method
+        self.hits = 0
+        self.misses = 0
+        self.prefix_hits = 0
+        # (配置键, n) -> 分布；按最近使用顺序排列
+        self._entries = OrderedDict()
+        # 配置键 -> 已缓存的 n（升序）
+        self._steps = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def config_key(level_count, start_level, upgrade_probabilities):
+        """生成配置键；低于初始等级的升级概率不影响结果，不计入键"""
+        q = np.asarray(upgrade_probabilities, dtype=np.float64)
+        return (level_count, start_level, q[start_level-1:].tobytes())
+
+    def get(self, level_count, start_level, upgrade_probabilities, n, progress=None):
+        """返回 n 次升级后的分布，优先使用缓存
+
+        progress 的含义同 advance_distribution；计算被取消时不写入缓存。
+        """
+        q = validate_config(level_count, start_level, upgrade_probabilities, n)
+        config = self.config_key(level_count, start_level, q)
+        key = (config, n)
+
+        with self._lock:
+            p = self._entries.get(key)
+            if p is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return p.copy()
+
+            self.misses += 1
+            # 查找同一配置中不超过 n 的最大缓存步数
+            steps = self._steps.get(config, [])
+            i = bisect.bisect_right(steps, n)
+            if i:
+                done = steps[i-1]
+                start = self._entries[(config, done)]
+                self._entries.move_to_end((config, done))
+                self.prefix_hits += 1
+            else:
+                done = 0
+                start = initial_distribution(level_count, start_level)
+
+        # 计算在锁外进行，避免长时间阻塞其他线程
+        p = advance_distribution(start, q, n - done, self.method, progress)
+
+        with self._lock:
+            self._store(config, n, p)
+        return p.copy()
+
+    def lookup(self, level_count, start_level, upgrade_probabilities, n):
+        """只查询缓存、不计算；命中时返回分布副本，否则返回 None"""
+        config = self.config_key(level_count, start_level, upgrade_probabilities)
+        with self._lock:
+            p = self._entries.get((config, n))
+            if p is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((config, n))
+            self.hits += 1
+            return p.copy()
+
+    def put(self, level_count, start_level, upgrade_probabilities, n, p):
+        """把在别处算好的分布（例如批量计算的结果）写入缓存"""
+        config = self.config_key(level_count, start_level, upgrade_probabilities)
+        with self._lock:
+            self._store(config, n, np.array(p, dtype=np.float64))
+
+    def _store(self, config, n, p):
+        """写入缓存并淘汰最久未使用的结果"""
+        key = (config, n)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = p
+        bisect.insort(self._steps.setdefault(config, []), n)
+
+        while len(self._entries) > self.maxsize:
+            (old_config, old_n), _ = self._entries.popitem(last=False)
+            steps = self._steps[old_config]
+            steps.remove(old_n)
+            if not steps:
+                del self._steps[old_config]
+
+    def stats(self):
+        """返回命中统计"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "prefix_hits": self.prefix_hits,
+            }
+
+    def clear(self):
+        """清空缓存和统计"""
+        with self._lock:
+            self._entries.clear()
+            self._steps.clear()
+            self.hits = self.misses = self.prefix_hits = 0
+
+
+class TransitionModel:
+    """稀疏转移模型：状态 src 以概率 prob 转移到状态 dst（COO 三元组）
+
+    每步的计算量与非零转移数成正比，而不是状态数的平方。state_levels[s] 为
+    状态 s 对应的宝箱等级（从0开始）；带保底计数的模型中多个状态对应同一等级。
+    """
+
+    def __init__(self, src, dst, prob, state_levels, level_count):
+        self.src = np.asarray(src, dtype=np.int64)
+        self.dst = np.asarray(dst, dtype=np.int64)
+        self.prob = np.asarray(prob, dtype=np.float64)
+        self.state_levels = np.asarray(state_levels, dtype=np.int64)
+        self.level_count = level_count
+        self.state_count = self.state_levels.size
+
+        if not (self.src.shape == self.dst.shape == self.prob.shape):
+            raise ValueError("src、dst、prob 的长度必须相同 / src, dst and prob must have the same length")
+        if self.src.size and (min(self.src.min(), self.dst.min()) < 0
+                              or max(self.src.max(), self.dst.max()) >= self.state_count):
+            raise ValueError("转移中的状态编号超出范围 / Transition state index out of range")
+        if np.any((self.prob < 0) | (self.prob > 1)):
+            raise ValueError("转移概率必须在0到1之间 / Transition probabilities must be between 0 and 1")
+        # 每个状态转出的概率之和必须为1
+        out = np.bincount(self.src, weights=self.prob, minlength=self.state_count)
+        bad = np.flatnonzero(np.abs(out - 1) > 1e-9)
+        if bad.size:
+            raise ValueError(f"状态 {int(bad[0])} 的转移概率之和为 {out[bad[0]]:.6g}，应为1 / "
+                             f"Transitions out of state {int(bad[0])} sum to {out[bad[0]]:.6g}, not 1")
+
+    @property
+    def nnz(self):
+        """非零转移数"""
+        return self.prob.size
+
+    def step(self, p):
+        """进行一次升级，O(非零转移数)"""
+        return np.bincount(self.dst, weights=p[self.src] * self.prob, minlength=self.state_count)
+
+    def to_dense(self):
+        """转换为稠密转移矩阵 M，满足 p_next = p @ M"""
+        M = np.zeros((self.state_count, self.state_count))
+        np.add.at(M, (self.src, self.dst), self.prob)
+        return M
+
+    def advance(self, p, steps, method="auto", progress=None):
+        """从状态分布 p 出发再进行 steps 次升级"""
+        if method not in METHODS:
+            raise ValueError(f"未知的计算方法 / Unknown method: {method}")
+        p = np.array(p, dtype=np.float64)
+        steps = whole_steps(steps)
+        if steps == 0:
+            return p
+
+        if method == "auto":
+            # 稀疏迭代每步的开销按非零转移数估算
+            iterative_cost = steps * (_STEP_OVERHEAD + self.nnz)
+            matrix_cost = 2 * steps.bit_length() * (
+                self.state_count ** 3 / _MATMUL_FLOPS_PER_UNIT + _MATMUL_OVERHEAD)
+            method = "matrix" if matrix_cost < iterative_cost else "iterative"
+
+        if method == "matrix":
+            return _apply_matrix_power(p, self.to_dense(), steps, progress)
+
+        done = 0
+        while done < steps:
+            block = min(PROGRESS_INTERVAL, steps - done) if progress is not None else steps
+            for _ in range(block):
+                p = self.step(p)
+            done += block
+            if progress is not None:
+                progress(done, steps)
+        return p
+
+    def initial_state(self, start_level):
+        """初始等级（从1开始）、计数为0的状态编号"""
+        if start_level < 1 or start_level > self.level_count:
+            raise ValueError(f"初始等级必须在1到{self.level_count}之间 / "
+                             f"Starting level must be between 1 and {self.level_count}")
+        return int(np.flatnonzero(self.state_levels == start_level - 1)[0])
+
+    def level_distribution(self, state_p):
+        """把状态分布合并为各等级的分布"""
+        return np.bincount(self.state_levels, weights=state_p, minlength=self.level_count)
+
+    def distribution(self, start_level, n, method="auto", progress=None):
+        """从初始等级出发 n 次升级后各等级的概率分布"""
+        if whole_steps(n) < 0:
+            raise ValueError("升级次数不能为负数 / Upgrade times cannot be negative")
+        p = np.zeros(self.state_count)
+        p[self.initial_state(start_level)] = 1.0
+        return self.level_distribution(self.advance(p, n, method, progress))
+
+
+def build_transition_model(level_count, upgrade_probabilities, downgrade_probabilities=None,
+                           skip_probabilities=None, pity=None):
+    """根据各级概率构造 TransitionModel
+
+    upgrade_probabilities[i]   等级 i+1 升到 i+2 的概率（L-1 个）
+    downgrade_probabilities[i] 等级 i+2 降到 i+1 的概率（L-1 个，可选）
+    skip_probabilities[i]      等级 i+1 直接升到 i+3 的概率（L-2 个，可选）
+    pity                       连续 pity 次没有升级后，下一次必定升级一级（可选）
+
+    每一级剩余的概率为保持原等级。最高等级不能升级，但可以按
+    downgrade_probabilities[L-2] 降级。只给出 upgrade_probabilities 时与
+    compute_distribution 的模型完全相同。保底计数通过扩充状态 (等级, 连续失败次数) 实现，
+    降级也算作一次失败；停留在最高等级不算失败，计数不变。
+    """
+    if level_count < 2:
+        raise ValueError("宝箱等级数量必须至少为2 / Number of chest levels must be at least 2")
+
+    def column(values, size, name):
+        if values is None:
+            return np.zeros(size)
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != (size,):
+            raise ValueError(f"需要 {size} 个{name} / Expected {size} values for {name}")
+        return values
+
+    up = np.append(column(upgrade_probabilities, level_count - 1, "升级概率"), 0.0)
+    down = np.insert(column(downgrade_probabilities, level_count - 1, "降级概率"), 0, 0.0)
+    skip = np.append(column(skip_probabilities, max(level_count - 2, 0), "跳级概率"), [0.0, 0.0])
+    stay = 1.0 - up - down - skip
+
+    bad = np.flatnonzero((np.minimum.reduce([up, down, skip]) < 0) | (stay < -1e-12))
+    if bad.size:
+        i = int(bad[0])
+        raise ValueError(f"等级 {i+1} 的各项转移概率必须非负且总和不超过100% / "
+                         f"Level {i+1} transition probabilities must be non-negative and sum to at most 100%")
+    stay = np.maximum(stay, 0.0)
+
+    counters = 1 if pity is None else pity + 1
+    if pity is not None and pity < 1:
+        raise ValueError("保底次数必须至少为1 / Pity threshold must be at least 1")
+
+    levels = np.arange(level_count)
+    top = level_count - 1
+    src, dst, prob = [], [], []
+
+    def state(level, counter):
+        return level * counters + counter
+
+    for counter in range(counters):
+        rows = levels[:top]
+        if pity is not None and counter == pity:
+            # 保底：连续失败 pity 次后必定升级
+            src.append(state(rows, counter))
+            dst.append(state(rows + 1, 0))
+            prob.append(np.ones(rows.size))
+            continue
+
+        # 失败（保持或降级）后计数加一，升级或跳级后计数清零
+        fail = counter + 1 if pity is not None else 0
+        for target, values, next_counter in ((rows, stay[rows], fail),
+                                             (rows + 1, up[rows], 0),
+                                             (np.minimum(rows + 2, top), skip[rows], 0),
+                                             (np.maximum(rows - 1, 0), down[rows], fail)):
+            keep = values > 0
+            src.append(state(rows[keep], counter))
+            dst.append(state(target[keep], next_counter))
+            prob.append(values[keep])
+
+    # 最高等级无法继续升级：停留时计数不变，降级时计数加一（不超过保底次数）
+    counter_range = np.arange(counters)
+    tops = state(top, counter_range)
+    fail = np.minimum(counter_range + 1, pity) if pity is not None else counter_range
+    for target, value in ((tops, stay[top]), (state(top - 1, fail), down[top])):
+        if value > 0:
+            src.append(tops)
+            dst.append(target)
+            prob.append(np.full(counters, value))
+
+    return TransitionModel(np.concatenate(src), np.concatenate(dst), np.concatenate(prob),
+                           np.repeat(levels, counters), level_count)
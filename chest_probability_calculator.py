@@ -1,16 +1,59 @@
+import time
+
+# 启动计时的起点，用于测量到第一帧可交互的时间
+START_TIME = time.perf_counter()
+
+import functools
+import queue
+import sys
+import threading
 import tkinter as tk
-from tkinter import ttk, messagebox
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from tkinter import ttk, messagebox, filedialog
 import numpy as np
-import matplotlib
 
-# 设置中文字体
-matplotlib.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei']  # 用黑体显示中文
-matplotlib.rcParams['axes.unicode_minus'] = False    # 正常显示负号
+import chest_engine
+import chest_profiling
+from chest_store import ResultStore
+from chest_widgets import DebugPanel, ScenarioBrowser, VirtualTable
+
+# 中文字体候选，按顺序使用已安装的字体（Windows、macOS、Linux）
+CJK_FONTS = ['SimHei', 'Microsoft YaHei', 'PingFang SC', 'Noto Sans CJK SC', 'WenQuanYi Micro Hei']
+
+@functools.lru_cache(maxsize=None)
+def resolve_cjk_fonts():
+    """查找已安装的中文字体，每个进程只查找一次"""
+    from matplotlib import font_manager
+    installed = {font.name for font in font_manager.fontManager.ttflist}
+    return tuple(name for name in CJK_FONTS if name in installed)
+
+def configure_fonts():
+    """设置中文字体；找不到中文字体时保留默认字体，避免每次绘制文字都重新查找"""
+    import matplotlib
+    fonts = list(resolve_cjk_fonts())
+    defaults = matplotlib.rcParamsDefault['font.sans-serif']
+    matplotlib.rcParams['font.sans-serif'] = fonts + [name for name in defaults if name not in fonts]
+    matplotlib.rcParams['axes.unicode_minus'] = False    # 正常显示负号
+
+@functools.lru_cache(maxsize=None)
+def load_chart_modules():
+    """第一次需要图表时才导入 matplotlib，导入耗时不影响窗口显示"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    configure_fonts()
+    return Figure, FigureCanvasTkAgg
 
 class ChestCalculator:
-    def __init__(self, root):
+    # 等级数量超过此值时不再绘制柱子上的数值标签
+    CHART_LABEL_LIMIT = 30
+    # X 轴最多显示的刻度标签数，超过时抽稀
+    CHART_TICK_LIMIT = 40
+    # 等级数量超过此值时用单个阶梯图代替逐个柱子
+    CHART_BAR_LIMIT = 200
+    # 升级概率表格和结果表格的可见行数
+    PROBABILITY_ROWS = 8
+    RESULT_ROWS = 10
+    
+    def __init__(self, root, debug=False):
         self.root = root
         self.root.title("宝箱开箱概率计算器 / Chest Probability Calculator")
         
@@ -55,7 +98,17 @@ class ChestCalculator:
                 "calc_error": "计算错误: {}",
                 "level_prob": "等级 {} 宝箱概率: {:.6f} ({:.4f}%)",
                 "level_prob_sci": "等级 {} 宝箱概率: {:.2e} ({:.2e}%)",
-                "total_prob": "概率总和: {:.10f}"
+                "total_prob": "概率总和: {:.10f}",
+                "cancel": "取消",
+                "calculating": "计算中...",
+                "cancelled": "计算已取消",
+                "save_scenario": "保存场景",
+                "load_scenario": "载入场景",
+                "export_chart": "导出图表",
+                "no_result": "没有可保存的结果，请先计算",
+                "no_chart": "还没有可导出的图表",
+                "saved_scenario": "已保存为第 {} 条记录",
+                "file_error": "文件错误: {}"
             },
             "en": {
                 "level_settings": "Level Settings",
@@ -92,7 +145,17 @@ Note:
                 "calc_error": "Calculation error: {}",
                 "level_prob": "Level {} Chest Probability: {:.6f} ({:.4f}%)",
                 "level_prob_sci": "Level {} Chest Probability: {:.2e} ({:.2e}%)",
-                "total_prob": "Total Probability: {:.10f}"
+                "total_prob": "Total Probability: {:.10f}",
+                "cancel": "Cancel",
+                "calculating": "Calculating...",
+                "cancelled": "Calculation cancelled",
+                "save_scenario": "Save Scenario",
+                "load_scenario": "Load Scenario",
+                "export_chart": "Export Chart",
+                "no_result": "No result to save; calculate first",
+                "no_chart": "No chart to export yet",
+                "saved_scenario": "Saved as row {}",
+                "file_error": "File error: {}"
             }
         }
         
@@ -102,6 +165,30 @@ Note:
         self.default_n = 4
         self.default_start_level = 1
         
+        # 计算结果缓存，参数不变时直接复用
+        self.cache = chest_engine.DistributionCache()
+        
+        # 后台计算状态：结果队列、当前计算的取消标志和编号
+        self.calc_queue = queue.Queue()
+        self.calc_cancel = None
+        self.calc_generation = 0
+        self.calc_polling = False
+        
+        # 正在计算和已显示结果的配置 (level_count, start_level, 升级概率, n)，保存场景时使用
+        self.calc_config = None
+        self.result_config = None
+        # 场景和结果存储，第一次保存或载入时选择目录
+        self.store = None
+        
+        # 各阶段计时和剖析，默认关闭，F12 打开调试面板
+        self.instrumentation = chest_profiling.Instrumentation(enabled=debug)
+        self.debug_panel = None
+        self.root.bind("<F12>", self.toggle_debug_panel)
+        
+        # 窗口第一次显示后记录启动耗时，并产生 <<FirstFrame>> 事件
+        self.startup_seconds = None
+        self.root.bind("<Map>", self.on_map, add="+")
+        
         # 创建主框架
         self.main_frame = ttk.Frame(root, padding="10")
         self.main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -117,8 +204,11 @@ Note:
         # 创建界面组件
         self.create_widgets()
         
-        # 初始计算
-        self.calculate_probabilities()
+        # 初始计算，窗口显示后再在后台进行
+        self.root.after_idle(self.calculate_probabilities)
+        
+        if debug:
+            self.toggle_debug_panel()
     
     def setup_window(self):
         """设置窗口大小和位置"""
@@ -161,11 +251,13 @@ Note:
         
         ttk.Label(self.level_frame, text=self.texts[self.language]["chest_levels"]).grid(row=0, column=0, sticky=tk.W, padx=(0, 5))
         self.level_count_var = tk.IntVar(value=self.default_levels)
+        self.level_count_var.trace_add("write", self.on_input_changed)
         self.level_count_entry = ttk.Entry(self.level_frame, textvariable=self.level_count_var, width=10)
         self.level_count_entry.grid(row=0, column=1, sticky=tk.W, padx=(0, 10))
         
         ttk.Label(self.level_frame, text=self.texts[self.language]["start_level"]).grid(row=0, column=2, sticky=tk.W, padx=(20, 5))
         self.start_level_var = tk.IntVar(value=self.default_start_level)
+        self.start_level_var.trace_add("write", self.on_input_changed)
         self.start_level_entry = ttk.Entry(self.level_frame, textvariable=self.start_level_var, width=10)
         self.start_level_entry.grid(row=0, column=3, sticky=tk.W, padx=(0, 10))
         
@@ -180,13 +272,17 @@ Note:
         # 升级次数输入
         ttk.Label(self.input_frame, text=self.texts[self.language]["upgrade_times"]).grid(row=0, column=0, sticky=tk.W, padx=(0, 5))
         self.n_var = tk.IntVar(value=self.default_n)
+        self.n_var.trace_add("write", self.on_input_changed)
         self.n_entry = ttk.Entry(self.input_frame, textvariable=self.n_var, width=10)
         self.n_entry.grid(row=0, column=1, sticky=tk.W, padx=(0, 10))
         
-        # 升级概率输入区域
-        self.probability_vars = []
-        self.probability_entries = []
-        self.probability_labels = []
+        # 升级概率输入区域：数组保存各级输入的文本，表格只为可见行创建控件
+        self.upgrade_chances = np.array([], dtype=object)
+        self.probability_offset = 0
+        self.probability_table = VirtualTable(self.input_frame, [(24, False), (10, True)], 
+                                              self.get_probability_cell, self.set_probability_cell, 
+                                              visible_rows=self.PROBABILITY_ROWS)
+        self.probability_table.grid(row=1, column=0, columnspan=2, sticky=tk.W)
         
         # 初始化升级概率输入
         self.update_level_inputs()
@@ -195,28 +291,35 @@ Note:
         self.result_frame = ttk.LabelFrame(self.main_frame, padding="10")
         self.result_frame.grid(row=3, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=(0, 10))
         
-        # 创建滚动文本框显示结果
-        self.result_text = tk.Text(self.result_frame, height=10, width=30)
+        # 各等级的结果表格，只为可见行创建控件
+        self.result_probabilities = np.zeros(0)
+        self.result_table = VirtualTable(self.result_frame, [(40, False)], self.get_result_cell, 
+                                         visible_rows=self.RESULT_ROWS)
+        self.result_table.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N))
+        
+        # 创建滚动文本框显示概率总和、状态和错误信息
+        self.result_text = tk.Text(self.result_frame, height=3, width=30)
         self.scrollbar = ttk.Scrollbar(self.result_frame, orient="vertical", command=self.result_text.yview)
         self.result_text.configure(yscrollcommand=self.scrollbar.set)
-        self.result_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        self.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.result_text.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.scrollbar.grid(row=1, column=1, sticky=(tk.N, tk.S))
         
         # 配置结果框架的网格权重
         self.result_frame.columnconfigure(0, weight=1)
-        self.result_frame.rowconfigure(0, weight=1)
+        self.result_frame.rowconfigure(1, weight=1)
         
         # 图表框架
         self.chart_frame = ttk.LabelFrame(self.main_frame, padding="10")
         self.chart_frame.grid(row=3, column=1, rowspan=2, sticky=(tk.W, tk.E, tk.N, tk.S))
         
-        # 创建图表
-        self.fig, self.ax = plt.subplots(figsize=(6, 5))
-        self.canvas = FigureCanvasTkAgg(self.fig, self.chart_frame)
-        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-        
-        # 初始化图表
-        self.update_chart([1.0] + [0.0]*(self.default_levels-1))
+        # 图表在第一次显示结果时才创建
+        self.fig = None
+        self.ax = None
+        self.canvas = None
+        self.chart_key = None
+        self.chart_bars = []
+        self.chart_steps = None
+        self.chart_labels = []
         
         # 计算按钮框架
         self.button_frame = ttk.Frame(self.main_frame)
@@ -226,6 +329,29 @@ Note:
                                   command=self.calculate_probabilities)
         self.calc_btn.grid(row=0, column=0)
         
+        self.cancel_btn = ttk.Button(self.button_frame, text=self.texts[self.language]["cancel"], 
+                                    command=self.cancel_calculation, state=tk.DISABLED)
+        self.cancel_btn.grid(row=0, column=1, padx=(10, 0))
+        
+        # 计算进度条
+        self.progress_var = tk.DoubleVar(value=0.0)
+        self.progress_bar = ttk.Progressbar(self.button_frame, variable=self.progress_var, 
+                                           maximum=1.0, length=150, mode="determinate")
+        self.progress_bar.grid(row=0, column=2, padx=(10, 0))
+        
+        # 场景保存、载入和图表导出
+        self.save_btn = ttk.Button(self.button_frame, text=self.texts[self.language]["save_scenario"], 
+                                  command=self.save_scenario)
+        self.save_btn.grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+        
+        self.load_btn = ttk.Button(self.button_frame, text=self.texts[self.language]["load_scenario"], 
+                                  command=self.load_scenario)
+        self.load_btn.grid(row=1, column=1, padx=(10, 0), pady=(5, 0))
+        
+        self.export_btn = ttk.Button(self.button_frame, text=self.texts[self.language]["export_chart"], 
+                                    command=self.export_chart)
+        self.export_btn.grid(row=1, column=2, sticky=tk.W, padx=(10, 0), pady=(5, 0))
+        
         # 说明文本
         self.help_label = ttk.Label(self.main_frame, text=self.texts[self.language]["instructions"], 
                                    justify=tk.LEFT)
@@ -257,10 +383,17 @@ Note:
         # 更新按钮文本
         self.apply_btn.configure(text=texts["apply_settings"])
         self.calc_btn.configure(text=texts["calculate"])
+        self.cancel_btn.configure(text=texts["cancel"])
+        self.save_btn.configure(text=texts["save_scenario"])
+        self.load_btn.configure(text=texts["load_scenario"])
+        self.export_btn.configure(text=texts["export_chart"])
         
         # 更新说明文本
         self.help_label.configure(text=texts["instructions"])
         
+        # 按新语言重新生成结果表格的文本
+        self.result_table.refresh()
+        
         # 更新等级设置标签
         for widget in self.level_frame.grid_slaves():
             if int(widget.grid_info()["row"]) == 0 and int(widget.grid_info()["column"]) == 0:
@@ -294,141 +427,282 @@ Note:
                                 self.texts[self.language]["invalid_level_count"])
             return
             
-        # 清除现有的概率输入框
-        for label in self.probability_labels:
-            label.destroy()
-            
-        for entry in self.probability_entries:
-            entry.destroy()
-        
-        self.probability_vars = []
-        self.probability_entries = []
-        self.probability_labels = []
-        
-        # 创建新的概率输入框
-        row_offset = 1
-        for i in range(level_count - 1):
-            # 如果初始等级大于当前等级，则跳过这个升级概率
-            if i + 1 < start_level:
-                continue
-                
-            label_text = self.texts[self.language]["upgrade_prob"].format(i+1, i+2)
-            label = ttk.Label(self.input_frame, text=label_text)
-            label.grid(row=row_offset, column=0, sticky=tk.W, padx=(0, 5), pady=(5, 0))
-            self.probability_labels.append(label)
-            
-            # 设置默认值，如果之前有值则使用之前的值，否则使用默认值
-            default_value = self.default_upgrade_chances[i] if i < len(self.default_upgrade_chances) else 50
-            var = tk.StringVar(value=str(default_value))
-            self.probability_vars.append(var)
+        with self.instrumentation.phase("widget_rebuild"):
+            # 调整升级概率数组的长度，保留已有的输入，新增的等级使用默认值
+            chances = np.empty(level_count - 1, dtype=object)
+            kept = min(len(self.upgrade_chances), level_count - 1)
+            chances[:kept] = self.upgrade_chances[:kept]
+            for i in range(kept, level_count - 1):
+                default_value = self.default_upgrade_chances[i] if i < len(self.default_upgrade_chances) else 50
+                chances[i] = str(default_value)
+            self.upgrade_chances = chances
             
-            entry = ttk.Entry(self.input_frame, textvariable=var, width=10)
-            entry.grid(row=row_offset, column=1, sticky=tk.W, padx=(0, 10), pady=(5, 0))
-            self.probability_entries.append(entry)
-            
-            row_offset += 1
+            # 如果初始等级大于当前等级，则不显示这个升级概率
+            self.probability_offset = start_level - 1
+            self.probability_table.set_row_count(level_count - start_level)
+    
+    def get_probability_cell(self, row, column):
+        """升级概率表格的单元格文本"""
+        i = self.probability_offset + row
+        if column == 0:
+            return self.texts[self.language]["upgrade_prob"].format(i+1, i+2)
+        return str(self.upgrade_chances[i])
+    
+    def set_probability_cell(self, row, column, text):
+        """升级概率被修改时写回数组"""
+        self.upgrade_chances[self.probability_offset + row] = text
+        self.on_input_changed()
+    
+    def get_result_cell(self, row, column):
+        """结果表格的单元格文本"""
+        self.instrumentation.count("result_cells")
+        prob = self.result_probabilities[row]
+        percentage = prob * 100
+        # 对于非常小的概率，使用科学计数法显示
+        if prob < 0.0001 and prob > 0:
+            return self.texts[self.language]["level_prob_sci"].format(row+1, prob, percentage)
+        return self.texts[self.language]["level_prob"].format(row+1, prob, percentage)
     
     def parse_percentage(self, value_str):
         """解析百分比输入，支持带%号和不带%号的输入"""
-        try:
-            # 去除空格
-            value_str = value_str.strip()
-            
-            # 如果以%结尾，去掉%号
-            if value_str.endswith('%'):
-                value_str = value_str[:-1]
-            
-            # 转换为浮点数
-            value = float(value_str)
-            
-            # 如果值大于1，假设是百分比格式，除以100
-            if value > 1:
-                value = value / 100.0
-                
-            return value
-        except ValueError:
-            raise ValueError(f"无法解析的概率值: {value_str}")
+        return chest_engine.parse_percentage(value_str)
     
     def calculate_probabilities(self):
         """计算各等级宝箱的概率"""
         try:
-            # 获取输入值
-            level_count = self.level_count_var.get()
-            start_level = self.start_level_var.get()
-            n = self.n_var.get()
-            
-            # 验证输入
-            if level_count < 2:
-                raise ValueError(self.texts[self.language]["invalid_levels"])
-            
-            if start_level < 1 or start_level > level_count:
-                raise ValueError(self.texts[self.language]["invalid_start_level"].format(level_count))
-            
-            if n < 0:
-                raise ValueError(self.texts[self.language]["invalid_upgrade_times"])
+            with self.instrumentation.phase("validation"):
+                # 获取输入值
+                level_count = self.level_count_var.get()
+                start_level = self.start_level_var.get()
+                n = self.n_var.get()
+                
+                # 验证输入
+                if level_count < 2:
+                    raise ValueError(self.texts[self.language]["invalid_levels"])
+                
+                if start_level < 1 or start_level > level_count:
+                    raise ValueError(self.texts[self.language]["invalid_start_level"].format(level_count))
+                
+                if n < 0:
+                    raise ValueError(self.texts[self.language]["invalid_upgrade_times"])
             
             # 获取升级概率
-            upgrade_probabilities = [0.0] * (level_count - 1)  # 初始化所有升级概率为0
+            upgrade_probabilities = np.zeros(level_count - 1)  # 初始化所有升级概率为0
             
-            # 只设置从初始等级开始的升级概率
-            for i, var in enumerate(self.probability_vars):
-                prob_index = start_level - 1 + i
-                if prob_index < level_count - 1:
-                    prob_str = var.get()
-                    prob = self.parse_percentage(prob_str)
-                    if not 0 <= prob <= 1:
-                        raise ValueError(self.texts[self.language]["invalid_prob"].format(prob_index+1, prob_index+2))
-                    upgrade_probabilities[prob_index] = prob
+            # 只设置从初始等级开始的升级概率，整列一次解析
+            chances = self.upgrade_chances[start_level-1:level_count-1]
+            with self.instrumentation.phase("parsing"):
+                values, errors = chest_engine.parse_percentages(chances, validate=False)
+            self.instrumentation.count("parsed_values", len(chances))
+            if errors:
+                raise ValueError(errors[0][2])
+            bad = np.flatnonzero(~((values >= 0) & (values <= 1)))
+            if bad.size:
+                prob_index = start_level - 1 + int(bad[0])
+                raise ValueError(self.texts[self.language]["invalid_prob"].format(prob_index+1, prob_index+2))
+            upgrade_probabilities[start_level-1:start_level-1+len(values)] = values
             
+        except Exception as e:
+            self.show_error(e)
+            return
+        
+        # 取消仍在进行的旧计算，在后台线程中开始新的计算
+        if self.calc_cancel is not None:
+            self.calc_cancel.set()
+        self.calc_generation += 1
+        self.calc_cancel = threading.Event()
+        self.calc_config = (level_count, start_level, upgrade_probabilities, n)
+        worker = threading.Thread(target=self.calculation_worker, 
+                                  args=(self.calc_generation, self.calc_cancel, 
+                                        level_count, start_level, upgrade_probabilities, n), 
+                                  daemon=True)
+        
+        self.progress_var.set(0.0)
+        self.cancel_btn.configure(state=tk.NORMAL)
+        self.result_table.set_row_count(0)
+        self.result_text.delete(1.0, tk.END)
+        self.result_text.insert(tk.END, self.texts[self.language]["calculating"])
+        worker.start()
+        
+        if not self.calc_polling:
+            self.calc_polling = True
+            self.root.after(50, self.poll_calculation)
+    
+    def calculation_worker(self, generation, cancel_event, level_count, start_level, upgrade_probabilities, n):
+        """后台线程：计算分布，进度和结果通过队列交回主线程"""
+        def progress(done, total):
+            if cancel_event.is_set():
+                raise chest_engine.CalculationCancelled()
+            self.calc_queue.put((generation, "progress", done / total))
+        
+        instrumentation = self.instrumentation
+        misses = self.cache.misses
+        try:
             # 计算概率 - 使用动态规划
-            # p[i] 表示处于第i+1级的概率
-            p = [0.0] * level_count
-            p[start_level-1] = 1.0  # 初始状态：初始等级宝箱概率为1
-            
-            for _ in range(n):
-                new_p = [0.0] * level_count
-                
-                # 处理每个等级
-                for i in range(level_count):
-                    if i < level_count - 1 and upgrade_probabilities[i] > 0:
-                        # 可以升级的等级：部分保持原等级，部分升级
-                        new_p[i] += p[i] * (1 - upgrade_probabilities[i])
-                        new_p[i+1] += p[i] * upgrade_probabilities[i]
-                    else:
-                        # 最高等级或无法升级的等级：只能保持原等级
-                        new_p[i] += p[i]
-                
-                p = new_p
+            with instrumentation.profile_thread(), instrumentation.phase("recurrence"):
+                p = self.cache.get(level_count, start_level, upgrade_probabilities, n, progress=progress)
+        except chest_engine.CalculationCancelled:
+            instrumentation.count("cancelled")
+            return
+        except Exception as e:
+            self.calc_queue.put((generation, "error", e))
+            return
+        if self.cache.misses != misses:
+            instrumentation.count("recurrence_steps", n)
+        else:
+            instrumentation.count("cache_hits")
+        self.calc_queue.put((generation, "done", p))
+    
+    def poll_calculation(self):
+        """在主线程中处理后台计算发回的进度和结果"""
+        while True:
+            try:
+                generation, kind, value = self.calc_queue.get_nowait()
+            except queue.Empty:
+                break
             
-            # 更新结果显示
-            self.result_text.delete(1.0, tk.END)
-            total_prob = 0
-            for i, prob in enumerate(p):
-                percentage = prob * 100
-                # 对于非常小的概率，使用科学计数法显示
-                if prob < 0.0001 and prob > 0:
-                    self.result_text.insert(tk.END, 
-                                          self.texts[self.language]["level_prob_sci"].format(i+1, prob, percentage) + "\n")
-                else:
-                    self.result_text.insert(tk.END, 
-                                          self.texts[self.language]["level_prob"].format(i+1, prob, percentage) + "\n")
-                total_prob += prob
+            # 忽略已取消或已过期的计算发回的消息
+            if self.calc_cancel is None or generation != self.calc_generation:
+                continue
             
-            self.result_text.insert(tk.END, "\n" + self.texts[self.language]["total_prob"].format(total_prob))
+            if kind == "progress":
+                self.progress_var.set(value)
+                continue
             
-            # 更新图表
-            self.update_chart(p)
+            self.calc_cancel = None
+            self.cancel_btn.configure(state=tk.DISABLED)
+            self.progress_var.set(1.0)
+            if kind == "done":
+                self.result_config = self.calc_config
+                self.show_results(value)
+            else:
+                self.show_error(value)
+        
+        if self.calc_cancel is not None:
+            self.root.after(50, self.poll_calculation)
+        else:
+            self.calc_polling = False
+    
+    def cancel_calculation(self):
+        """取消正在进行的计算"""
+        if self.calc_cancel is None:
+            return
+        self.calc_cancel.set()
+        self.calc_cancel = None
+        self.cancel_btn.configure(state=tk.DISABLED)
+        self.progress_var.set(0.0)
+        self.result_text.delete(1.0, tk.END)
+        self.result_text.insert(tk.END, self.texts[self.language]["cancelled"])
+    
+    def on_input_changed(self, *args):
+        """输入变化时取消已过期的计算"""
+        self.cancel_calculation()
+    
+    def show_results(self, p):
+        """显示计算结果并更新图表"""
+        with self.instrumentation.phase("result_text"):
+            # 更新结果显示，各等级的文本由结果表格按需生成
+            self.result_probabilities = np.asarray(p)
+            self.result_table.set_row_count(len(p))
             
-        except Exception as e:
-            # 显示错误信息
+            total_prob = float(np.sum(self.result_probabilities))
             self.result_text.delete(1.0, tk.END)
-            self.result_text.insert(tk.END, self.texts[self.language]["calc_error"].format(str(e)))
+            self.result_text.insert(tk.END, self.texts[self.language]["total_prob"].format(total_prob))
+        
+        # 更新图表
+        self.update_chart(p)
     
-    def update_chart(self, probabilities):
-        """更新概率分布图表"""
-        self.ax.clear()
+    def show_error(self, error):
+        """显示错误信息"""
+        self.result_config = None
+        self.result_table.set_row_count(0)
+        self.result_text.delete(1.0, tk.END)
+        self.result_text.insert(tk.END, self.texts[self.language]["calc_error"].format(str(error)))
+    
+    def open_store(self):
+        """选择结果存储目录，不存在时新建；返回是否成功"""
+        texts = self.texts[self.language]
+        path = filedialog.askdirectory(parent=self.root, mustexist=False)
+        if not path:
+            return False
+        try:
+            store = ResultStore(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror(texts["error"], texts["file_error"].format(e))
+            return False
+        if self.store is not None:
+            self.store.close()
+        self.store = store
+        return True
+    
+    def save_scenario(self):
+        """把当前显示的配置和结果追加到结果存储"""
+        texts = self.texts[self.language]
+        if self.result_config is None:
+            messagebox.showerror(texts["error"], texts["no_result"])
+            return
+        if self.store is None and not self.open_store():
+            return
+        level_count, start_level, upgrade_probabilities, n = self.result_config
+        try:
+            row = self.store.append(level_count, start_level, n, upgrade_probabilities, 
+                                    self.result_probabilities)
+        except (OSError, ValueError) as e:
+            messagebox.showerror(texts["error"], texts["file_error"].format(e))
+            return
+        self.result_text.insert(tk.END, "\n" + texts["saved_scenario"].format(row))
+    
+    def load_scenario(self):
+        """选择结果存储，在场景列表中选择要载入的记录"""
+        if self.open_store():
+            ScenarioBrowser(self.root, self.store, self.apply_scenario)
+    
+    def apply_scenario(self, row):
+        """把存储中的一条记录填回输入框，并直接显示保存的结果"""
+        level_count, start_level, n, upgrade_probabilities = self.store.config(row)
+        p = np.asarray(self.store.distribution(row), dtype=float)
+        
+        # 先写入升级概率，update_level_inputs 会保留长度足够的已有输入；
+        # 以小数形式写回（不大于1的值按小数解析），写成百分比时不超过1%的值会被误读
+        self.upgrade_chances = np.array([repr(float(value)) for value in upgrade_probabilities], dtype=object)
+        self.level_count_var.set(level_count)
+        self.start_level_var.set(start_level)
+        self.n_var.set(n)
+        self.update_level_inputs()
         
-        level_count = len(probabilities)
+        self.result_config = (level_count, start_level, upgrade_probabilities, n)
+        self.show_results(p)
+    
+    def export_chart(self):
+        """把当前图表保存为 PNG、SVG 或 PDF"""
+        texts = self.texts[self.language]
+        if self.fig is None:
+            messagebox.showerror(texts["error"], texts["no_chart"])
+            return
+        path = filedialog.asksaveasfilename(parent=self.root, defaultextension=".png", 
+                                            filetypes=[("PNG", "*.png"), ("SVG", "*.svg"), ("PDF", "*.pdf")])
+        if not path:
+            return
+        try:
+            self.fig.savefig(path, dpi=150)
+        except (OSError, ValueError) as e:
+            messagebox.showerror(texts["error"], texts["file_error"].format(e))
+    
+    def create_chart(self):
+        """导入 matplotlib 并创建图表"""
+        with self.instrumentation.phase("chart_import"):
+            Figure, FigureCanvasTkAgg = load_chart_modules()
+        self.fig = Figure(figsize=(6, 5))
+        self.ax = self.fig.add_subplot()
+        self.canvas = FigureCanvasTkAgg(self.fig, self.chart_frame)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        # draw_idle 最终调用 draw，在这里统计实际的绘制耗时
+        self.canvas.draw = self.instrumentation.wrap("chart_draw", self.canvas.draw)
+    
+    def build_chart(self, level_count):
+        """重新创建图表中的柱子和标签，只在等级数量或语言变化时调用"""
+        import matplotlib
+        self.ax.clear()
         
         # 根据语言设置标签
         if self.language == "zh":
@@ -442,63 +716,152 @@ Note:
             ylabel = "Probability (%)"
             title = "Chest Probability Calculation"
         
-        # 将概率转换为百分比
-        percentages = [p * 100 for p in probabilities]
-        
         # 生成颜色
-        colors = plt.cm.viridis(np.linspace(0, 1, level_count))
-        
-        bars = self.ax.bar(levels, percentages, color=colors)
-        
-        # 在柱子上添加数值标签
-        max_percentage = max(percentages) if percentages else 1
-        label_offset = max_percentage * 0.01  # 标签偏移量
+        colors = matplotlib.colormaps["viridis"](np.linspace(0, 1, level_count))
         
-        for i, bar in enumerate(bars):
-            height = bar.get_height()
-            # 即使概率很小也显示标签
-            if height > 0:
-                # 对于非常小的概率，使用科学计数法
-                if height < 0.01:
-                    label_text = f'{percentages[i]:.1e}%'
-                else:
-                    label_text = f'{percentages[i]:.2f}%'
-                
-                # 调整标签位置，确保即使概率很小也能看到
-                va = 'bottom'
-                y_pos = height + label_offset
-                
-                # 如果柱子高度很小，将标签放在柱子内部顶部
-                if height < max_percentage * 0.05:
-                    va = 'top'
-                    y_pos = height - label_offset
-                    # 确保不会显示在负值区域
-                    if y_pos < 0:
-                        y_pos = height + label_offset
-                        va = 'bottom'
-                
-                self.ax.text(bar.get_x() + bar.get_width()/2., y_pos,
-                            label_text,
-                            ha='center', va=va, fontsize=8)
+        positions = np.arange(level_count)
+        if level_count <= self.CHART_BAR_LIMIT:
+            self.chart_bars = list(self.ax.bar(positions, np.zeros(level_count), color=colors))
+            self.chart_steps = None
+        else:
+            # 等级很多时柱子比像素还窄，用单个阶梯图绘制，重绘开销与等级数量基本无关
+            self.chart_bars = []
+            self.chart_steps = self.ax.stairs(np.zeros(level_count), np.arange(level_count + 1) - 0.5,
+                                              fill=True, color=colors[level_count // 2])
+            self.ax.set_xlim(-0.5, level_count - 0.5)
+        
+        # 等级太多时抽稀刻度标签
+        step = max(1, -(-level_count // self.CHART_TICK_LIMIT))
+        self.ax.set_xticks(positions[::step], levels[::step])
+        
+        # 在柱子上添加数值标签，等级太多时不绘制
+        self.chart_labels = []
+        if level_count <= self.CHART_LABEL_LIMIT:
+            for position in positions:
+                label = self.ax.text(position, 0, "",
+                                     ha='center', va='bottom', fontsize=8)
+                self.chart_labels.append(label)
         
         self.ax.set_ylabel(ylabel)
         self.ax.set_xlabel(xlabel)
         self.ax.set_title(title)
         
-        # 设置Y轴范围，留出一些空间
-        self.ax.set_ylim(0, max_percentage * 1.15 if max_percentage > 0 else 1)
-        
         # 如果等级太多，旋转X轴标签
         if level_count > 5:
-            plt.setp(self.ax.get_xticklabels(), rotation=45, ha='right')
+            matplotlib.artist.setp(self.ax.get_xticklabels(), rotation=45, ha='right')
         
         self.fig.tight_layout()
-        self.canvas.draw()
+        self.chart_key = (level_count, self.language)
+    
+    def update_chart(self, probabilities):
+        """更新概率分布图表，等级数量和语言不变时原位更新柱高和标签"""
+        if self.fig is None:
+            self.create_chart()
+        
+        level_count = len(probabilities)
+        if self.chart_key != (level_count, self.language):
+            with self.instrumentation.phase("chart_build"):
+                self.build_chart(level_count)
+        
+        with self.instrumentation.phase("chart_update"):
+            self.update_chart_artists(probabilities)
+        
+        # 合并重绘请求，由 Tk 空闲时统一绘制
+        self.canvas.draw_idle()
+    
+    def update_chart_artists(self, probabilities):
+        """原位更新柱高、标签和 Y 轴范围"""
+        level_count = len(probabilities)
+        
+        # 将概率转换为百分比
+        percentages = np.asarray(probabilities, dtype=float) * 100
+        
+        if self.chart_steps is not None:
+            self.chart_steps.set_data(percentages)
+        for bar, height in zip(self.chart_bars, percentages):
+            bar.set_height(height)
+        
+        max_percentage = percentages.max() if level_count else 1
+        label_offset = max_percentage * 0.01  # 标签偏移量
+        
+        for label, height in zip(self.chart_labels, percentages):
+            # 即使概率很小也显示标签
+            if height <= 0:
+                label.set_visible(False)
+                continue
+            
+            # 对于非常小的概率，使用科学计数法
+            if height < 0.01:
+                label_text = f'{height:.1e}%'
+            else:
+                label_text = f'{height:.2f}%'
+            
+            # 调整标签位置，确保即使概率很小也能看到
+            va = 'bottom'
+            y_pos = height + label_offset
+            
+            # 如果柱子高度很小，将标签放在柱子内部顶部
+            if height < max_percentage * 0.05:
+                va = 'top'
+                y_pos = height - label_offset
+                # 确保不会显示在负值区域
+                if y_pos < 0:
+                    y_pos = height + label_offset
+                    va = 'bottom'
+            
+            label.set_text(label_text)
+            label.set_y(y_pos)
+            label.set_va(va)
+            label.set_visible(True)
+        
+        # 设置Y轴范围，留出一些空间
+        self.ax.set_ylim(0, max_percentage * 1.15 if max_percentage > 0 else 1)
+    
+    def on_map(self, event):
+        """主窗口第一次显示时，等待已排队的重绘完成后记录启动耗时"""
+        if event.widget is not self.root or self.startup_seconds is not None:
+            return
+        self.startup_seconds = 0.0
+        self.root.after_idle(self.record_first_frame)
+    
+    def record_first_frame(self):
+        self.startup_seconds = time.perf_counter() - START_TIME
+        self.instrumentation.record("startup", self.startup_seconds)
+        self.root.event_generate("<<FirstFrame>>")
+    
+    def toggle_debug_panel(self, event=None):
+        """打开或关闭调试面板"""
+        if self.debug_panel is not None and self.debug_panel.winfo_exists():
+            self.debug_panel.destroy()
+            self.debug_panel = None
+            return
+        self.debug_panel = DebugPanel(self.root, self.instrumentation)
 
-def main():
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    
+    # 命令行子命令：sweep 批量扫描，simulate 蒙特卡洛模拟，serve 本地计算服务，不启动图形界面
+    if argv and argv[0] == "sweep":
+        import chest_sweep
+        return chest_sweep.main(argv[1:])
+    if argv and argv[0] == "simulate":
+        import chest_simulation
+        return chest_simulation.main(argv[1:])
+    if argv and argv[0] == "serve":
+        import chest_server
+        return chest_server.main(argv[1:])
+    
+    # --debug 启动时即开启计时并打开调试面板
     root = tk.Tk()
-    app = ChestCalculator(root)
+    app = ChestCalculator(root, debug="--debug" in argv)
+    if "--startup-time" in argv:
+        # 只测量启动时间：第一帧显示后打印耗时并退出
+        def report_startup(event):
+            print(f"startup: {app.startup_seconds * 1000:.1f} ms", file=sys.stderr)
+            root.destroy()
+        root.bind("<<FirstFrame>>", report_startup)
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
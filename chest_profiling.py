@@ -0,0 +1,274 @@
+"""性能计时与剖析 / Instrumentation and profiling hooks
+
+按阶段统计耗时和计数（验证、解析、递推、结果文本、图表绘制、控件重建），
+默认关闭，关闭时每个计时点只有一次属性判断的开销。
+剖析器可以在运行中开启和关闭：cProfile 记录确定性的调用统计，
+采样剖析器定期抓取所有线程的调用栈，包括后台计算线程。
+"""
+import cProfile
+import datetime
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILERS = ("cprofile", "sampling")
+
+
+class PhaseStats:
+    """单个阶段的累计统计"""
+    __slots__ = ("count", "total", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "max_ms": self.max * 1000,
+            "last_ms": self.last * 1000,
+        }
+
+
+class Instrumentation:
+    """线程安全的阶段计时器和计数器"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.phases = {}
+        self.counters = Counter()
+        self.profiler = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """统计 with 块的耗时"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """记录一次耗时（秒）"""
+        with self._lock:
+            stats = self.phases.get(name)
+            if stats is None:
+                stats = self.phases[name] = PhaseStats()
+            stats.add(seconds)
+
+    def count(self, name, amount=1):
+        """增加计数"""
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += amount
+
+    def wrap(self, name, func):
+        """返回统计 func 每次调用耗时的包装函数"""
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def reset(self):
+        with self._lock:
+            self.phases.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        """导出为可序列化的字典"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "phases": {name: stats.snapshot() for name, stats in sorted(self.phases.items())},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def format_report(self):
+        """格式化为调试面板中显示的文本"""
+        snapshot = self.snapshot()
+        lines = [f"{'phase':<22}{'count':>8}{'total ms':>12}{'mean ms':>10}{'max ms':>10}{'last ms':>10}"]
+        for name, stats in snapshot["phases"].items():
+            lines.append(f"{name:<22}{stats['count']:>8}{stats['total_ms']:>12.2f}"
+                         f"{stats['mean_ms']:>10.3f}{stats['max_ms']:>10.3f}{stats['last_ms']:>10.3f}")
+        if snapshot["counters"]:
+            lines.append("")
+            lines.extend(f"{name:<22}{value:>8}" for name, value in snapshot["counters"].items())
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """把统计和剖析结果写入 JSON 文件"""
+        data = self.snapshot()
+        data["timestamp"] = datetime.datetime.now().isoformat(timespec="seconds")
+        data["python"] = sys.version.split()[0]
+        if self.profiler is not None:
+            data["profiler"] = {"kind": self.profiler.kind, "report": self.profiler.report()}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+
+    def start_profiler(self, kind="cprofile"):
+        """开始剖析，已有的剖析器先停止"""
+        if kind not in PROFILERS:
+            raise ValueError(f"未知的剖析器 / Unknown profiler: {kind}")
+        self.stop_profiler()
+        self.profiler = CProfileProfiler() if kind == "cprofile" else SamplingProfiler()
+        self.profiler.start()
+        return self.profiler
+
+    def stop_profiler(self):
+        """停止剖析，保留结果直到下一次开始；返回剖析器"""
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.stop()
+        return profiler
+
+    @contextmanager
+    def profile_thread(self):
+        """在后台线程中使用，使 cProfile 也覆盖该线程"""
+        profiler = self.profiler
+        if isinstance(profiler, CProfileProfiler):
+            with profiler.thread():
+                yield
+        else:
+            yield
+
+
+class CProfileProfiler:
+    """cProfile 剖析器
+
+    cProfile 只记录开启它的线程，后台线程通过 thread() 各自开启一个，
+    报告时合并。Python 3.12 起 cProfile 已覆盖所有线程，不能再开启第二个。
+    """
+    kind = "cprofile"
+
+    def __init__(self):
+        self.profiles = []
+        self.running = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        profile.enable()
+        self.running = True
+
+    def stop(self):
+        if self.running:
+            self.profiles[0].disable()
+            self.running = False
+
+    @contextmanager
+    def thread(self):
+        if not self.running:
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 已有覆盖所有线程的剖析器
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                self.profiles.append(profile)
+
+    def report(self, limit=40):
+        stream = io.StringIO()
+        with self._lock:
+            profiles = list(self.profiles)
+        if self.running:
+            # 运行中的剖析器需要先暂停才能读取统计
+            profiles[0].disable()
+        try:
+            stats = pstats.Stats(*profiles, stream=stream)
+        finally:
+            if self.running:
+                profiles[0].enable()
+        stats.sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+
+class SamplingProfiler:
+    """采样剖析器：定期记录所有线程的调用栈，开销与被测代码无关"""
+    kind = "sampling"
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self.inclusive = Counter()
+        self.exclusive = Counter()
+        self.running = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._stop.clear()
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self.running:
+            self._stop.set()
+            self._thread.join()
+            self.running = False
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    self.samples += 1
+                    leaf = True
+                    seen = set()
+                    while frame is not None:
+                        code = frame.f_code
+                        key = (code.co_filename, code.co_firstlineno, code.co_name)
+                        if leaf:
+                            self.exclusive[key] += 1
+                            leaf = False
+                        # 递归函数每个样本只计一次
+                        if key not in seen:
+                            seen.add(key)
+                            self.inclusive[key] += 1
+                        frame = frame.f_back
+
+    def report(self, limit=40):
+        with self._lock:
+            samples = self.samples
+            rows = self.inclusive.most_common(limit)
+            exclusive = dict(self.exclusive)
+        lines = [f"{samples} samples, interval {self.interval * 1000:g} ms",
+                 f"{'total %':>8}{'self %':>8}  function"]
+        for key, count in rows:
+            filename, line, name = key
+            lines.append(f"{count / samples * 100:>8.1f}{exclusive.get(key, 0) / samples * 100:>8.1f}"
+                         f"  {name} ({filename}:{line})")
+        return "\n".join(lines)
@@ -0,0 +1,371 @@
+"""本地 HTTP/JSON 计算服务 / Local HTTP/JSON calculation service
+
+基于 asyncio，只监听回环地址。并发的请求在很短的时间窗口内合并为一次
+向量化的批量计算，前面有结果缓存，并记录延迟直方图。
+
+用法示例:
+    python chest_probability_calculator.py serve --port 8765
+
+接口:
+    POST /distribution  {"level_count": 5, "start_level": 1, "n": 4,
+                         "upgrade_probabilities": [50, 45, 40, 30]}
+                        也可以提交这样的对象组成的列表
+    GET  /metrics       延迟直方图、批量和缓存统计
+    GET  /health
+"""
+import argparse
+import asyncio
+import bisect
+import ipaddress
+import json
+import sys
+import time
+
+import numpy as np
+
+import chest_engine
+
+# 延迟直方图的桶上界（毫秒）
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+# 请求体大小上限
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class LatencyHistogram:
+    """按固定桶统计延迟"""
+
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        """记录一次耗时（秒）"""
+        self.counts[bisect.bisect_left(self.buckets_ms, seconds * 1000)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, x):
+        """按桶上界估计分位数（毫秒）"""
+        if not self.count:
+            return 0.0
+        rank = x * self.count
+        seen = 0
+        for bound, count in zip(self.buckets_ms + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        """导出为可序列化的字典"""
+        labels = [f"le_{bound}ms" for bound in self.buckets_ms] + ["inf"]
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p99_ms": self.quantile(0.99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class MicroBatcher:
+    """把短时间窗口内的并发请求合并为批量计算"""
+
+    def __init__(self, cache, max_batch=256, window=0.002):
+        self.cache = cache
+        self.max_batch = max_batch
+        self.window = window
+        self.queue = asyncio.Queue()
+        self.batches = 0
+        self.batched_items = 0
+        self.batch_latency = LatencyHistogram()
+        # 正在计算的配置：(配置键, n) -> future，同一配置的并发请求共享一次计算
+        self.inflight = {}
+        self.coalesced = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, level_count, start_level, q, n):
+        """提交一个配置，返回其分布；缓存命中或同一配置正在计算时不进入批量队列"""
+        key = (self.cache.config_key(level_count, start_level, q), n)
+        future = self.inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            p = self.cache.lookup(level_count, start_level, q, n)
+            if p is not None:
+                return p
+            future = asyncio.get_running_loop().create_future()
+            self.inflight[key] = future
+            await self.queue.put((level_count, start_level, q, n, future))
+        # 多个请求等待同一个 future，某个请求被取消时不能取消共享的计算
+        return await asyncio.shield(future)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # 等到第一个请求，再在时间窗口内收集更多请求
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(items) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            start = time.perf_counter()
+            # 批量计算放在线程池中，不阻塞事件循环
+            results = await loop.run_in_executor(None, self._compute, items)
+            self.batch_latency.observe(time.perf_counter() - start)
+            self.batches += 1
+            self.batched_items += len(items)
+
+            for item, (p, error) in zip(items, results):
+                level_count, start_level, q, n, future = item
+                self.inflight.pop((self.cache.config_key(level_count, start_level, q), n), None)
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(p)
+
+    def _compute(self, items):
+        """按等级数量分组，每组一次向量化计算，返回 [(分布, 异常)]"""
+        results = [None] * len(items)
+        groups = {}
+        for i, (level_count, start_level, q, n, _) in enumerate(items):
+            groups.setdefault(level_count, []).append(i)
+
+        for level_count, indices in groups.items():
+            Q = np.array([items[i][2] for i in indices])
+            starts = np.array([items[i][1] for i in indices])
+            ns = np.array([items[i][3] for i in indices])
+            try:
+                P = chest_engine.compute_distribution_batch(Q, starts, ns)
+            except Exception as e:
+                for i in indices:
+                    results[i] = (None, e)
+                continue
+            for i, p in zip(indices, P):
+                level_count, start_level, q, n, _ = items[i]
+                self.cache.put(level_count, start_level, q, n, p)
+                results[i] = (p, None)
+        return results
+
+
+def parse_config(data):
+    """把 JSON 请求转换为 (level_count, start_level, 升级概率数组, n)，并验证"""
+    if not isinstance(data, dict):
+        raise ValueError("请求必须是 JSON 对象 / Request must be a JSON object")
+    try:
+        level_count = int(data["level_count"])
+        start_level = int(data.get("start_level", 1))
+        n = data["n"]
+        n_is_fraction = isinstance(n, float) and not n.is_integer()
+        n = int(n)
+        probs = data["upgrade_probabilities"]
+    except KeyError as e:
+        raise ValueError(f"缺少字段 / Missing field: {e}")
+    except (TypeError, ValueError, OverflowError) as e:
+        raise ValueError(f"字段类型错误 / Invalid field: {e}")
+    if n_is_fraction:
+        raise ValueError(f"升级次数必须是整数 / Upgrade times must be a whole number: {data['n']}")
+    if not isinstance(probs, list):
+        raise ValueError("upgrade_probabilities 必须是列表 / upgrade_probabilities must be a list")
+
+    # 数字和 "45%" 形式的字符串按同样的规则解析
+    q, errors = chest_engine.parse_percentages([str(value) for value in probs], validate=False)
+    if errors:
+        raise ValueError(errors[0][2])
+    # 批量计算使用 int64 保存升级次数
+    if n > np.iinfo(np.int64).max:
+        raise ValueError("升级次数超出范围 / Upgrade times out of range")
+    q = chest_engine.validate_config(level_count, start_level, q, n)
+    return level_count, start_level, q, n
+
+
+class CalculationServer:
+    """HTTP 服务：解析请求、分发到各个接口并记录延迟"""
+
+    def __init__(self, max_batch=256, window=0.002, cache_size=4096):
+        self.cache = chest_engine.DistributionCache(cache_size)
+        self.batcher = MicroBatcher(self.cache, max_batch, window)
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.errors = 0
+
+    async def handle_distribution(self, body):
+        data = json.loads(body)
+        if isinstance(data, list):
+            configs = [parse_config(item) for item in data]
+            results = await asyncio.gather(*(self.batcher.submit(*config) for config in configs))
+            return [{"distribution": p.tolist()} for p in results]
+        level_count, start_level, q, n = parse_config(data)
+        p = await self.batcher.submit(level_count, start_level, q, n)
+        return {"distribution": p.tolist()}
+
+    def metrics(self):
+        batches = self.batcher.batches
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency": self.latency.snapshot(),
+            "batch": {
+                "batches": batches,
+                "items": self.batcher.batched_items,
+                "mean_size": self.batcher.batched_items / batches if batches else 0.0,
+                "coalesced": self.batcher.coalesced,
+                "latency": self.batcher.batch_latency.snapshot(),
+            },
+            "cache": self.cache.stats(),
+        }
+
+    async def dispatch(self, method, path, body):
+        """返回 (状态码, JSON 对象)"""
+        if path == "/distribution":
+            if method != "POST":
+                return 405, {"error": "Method Not Allowed"}
+            try:
+                return 200, await self.handle_distribution(body)
+            except (ValueError, UnicodeDecodeError) as e:
+                return 400, {"error": str(e)}
+        if path == "/metrics" and method == "GET":
+            return 200, self.metrics()
+        if path == "/health" and method == "GET":
+            return 200, {"status": "ok"}
+        return 404, {"error": "Not Found"}
+
+    async def handle_connection(self, reader, writer):
+        """处理一个连接，支持 keep-alive"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                start = time.perf_counter()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    # 无法确定请求体的长度，回复后关闭连接
+                    length = None
+                if length is None:
+                    status, payload = 400, {"error": "Invalid Content-Length"}
+                elif length > MAX_BODY_BYTES:
+                    status, payload = 413, {"error": "Payload Too Large"}
+                    body = b""
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    try:
+                        status, payload = await self.dispatch(method, target.split("?", 1)[0], body)
+                    except Exception as e:
+                        status, payload = 500, {"error": str(e)}
+
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              and version == "HTTP/1.1" and length is not None and status != 413)
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+
+                self.requests += 1
+                if status >= 400:
+                    self.errors += 1
+                self.latency.observe(time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, ready=None):
+        """启动服务直到被取消；ready(端口) 在开始监听后调用"""
+        check_loopback(host)
+        self.batcher.start()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        try:
+            if ready is not None:
+                ready(server.sockets[0].getsockname()[1])
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+
+
+def check_loopback(host):
+    """只允许监听回环地址"""
+    if host == "localhost":
+        return
+    try:
+        if ipaddress.ip_address(host).is_loopback:
+            return
+    except ValueError:
+        pass
+    raise ValueError(f"服务只能监听回环地址 / The service may only bind to a loopback address: {host}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="chest_probability_calculator.py serve",
+        description="本地宝箱概率计算服务 / Local chest probability service")
+    parser.add_argument("--host", default="127.0.0.1", help="回环地址 / loopback address")
+    parser.add_argument("--port", type=int, default=8765, help="端口 / port")
+    parser.add_argument("--max-batch", type=int, default=256, help="每批最多请求数 / max requests per batch")
+    parser.add_argument("--batch-window-ms", type=float, default=2.0, help="合并窗口（毫秒） / batching window")
+    parser.add_argument("--cache-size", type=int, default=4096, help="缓存条数 / cache entries")
+    args = parser.parse_args(argv)
+
+    try:
+        check_loopback(args.host)
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = CalculationServer(args.max_batch, args.batch_window_ms / 1000, args.cache_size)
+    try:
+        asyncio.run(server.serve(args.host, args.port,
+                                 ready=lambda port: print(f"http://{args.host}:{port}/", file=sys.stderr)))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""蒙特卡洛模拟 / Monte Carlo simulation of chest upgrades
+
+按同一条升级链随机模拟大量开箱轨迹，用于与精确的动态规划结果相互校验。
+每条轨迹在第 i 级停留的次数服从参数为 q_i 的几何分布，因此一次抽样即可
+得到 n 次升级后的等级，耗时与 n 无关。
+
+用法示例:
+    python chest_probability_calculator.py simulate --levels 5 --n 4 \
+        --probs "50 45 40 30" --samples 1000000 --seed 1
+"""
+import argparse
+import json
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+
+import chest_engine
+
+# 每块抽样时几何分布矩阵的元素上限，控制内存
+_CHUNK_ELEMENTS = 8 * 1024 * 1024
+
+SimulationResult = namedtuple("SimulationResult", [
+    "distribution",     # 各等级的经验概率
+    "lower",            # 置信区间下界
+    "upper",            # 置信区间上界
+    "counts",           # 各等级的样本数
+    "samples",          # 总样本数
+    "exact",            # 精确分布
+    "max_abs_error",    # 经验分布与精确分布的最大绝对误差
+    "total_variation",  # 总变差距离
+    "chi_square",       # 卡方统计量
+    "degrees_of_freedom",
+])
+
+
+def sample_final_levels(rng, level_count, start_level, upgrade_probabilities, n, size):
+    """抽样 size 条轨迹在 n 次升级后的等级（从1开始）"""
+    q = np.asarray(upgrade_probabilities, dtype=np.float64)[start_level-1:]
+    levels = np.full(size, start_level, dtype=np.int64)
+    if q.size == 0 or n == 0:
+        return levels
+
+    # 升级概率为0的等级永远无法离开，停留次数视为 n+1
+    stuck = q == 0
+    safe_q = np.where(stuck, 1.0, q)
+    rows = max(1, _CHUNK_ELEMENTS // q.size)
+    for lo in range(0, size, rows):
+        hi = min(lo + rows, size)
+        stays = rng.geometric(safe_q, size=(hi - lo, q.size))
+        stays[:, stuck] = n + 1
+        # 极小的升级概率会使几何分布饱和到 int64 上限，累加后溢出为负数；
+        # 停留次数超过 n 的部分不影响结果，先截断
+        np.minimum(stays, n + 1, out=stays)
+        # 累计停留次数不超过 n 的等级都已经升级离开
+        levels[lo:hi] += np.count_nonzero(np.cumsum(stays, axis=1) <= n, axis=1)
+    return levels
+
+
+def _simulate_chunk(args):
+    """在工作进程中模拟一块样本，返回各等级的计数"""
+    seed, level_count, start_level, q, n, size = args
+    rng = np.random.default_rng(seed)
+    levels = sample_final_levels(rng, level_count, start_level, q, n, size)
+    return np.bincount(levels - 1, minlength=level_count)
+
+
+def simulate_counts(level_count, start_level, upgrade_probabilities, n, samples,
+                    seed=None, chunk_size=1_000_000, workers=1):
+    """模拟 samples 条轨迹，返回各等级的样本数
+
+    每块样本使用 SeedSequence(seed).spawn 派生的独立种子，
+    因此同一个 seed 的结果与进程数无关，可以复现。
+    """
+    q = chest_engine.validate_config(level_count, start_level, upgrade_probabilities, n)
+    if samples < 1:
+        raise ValueError("样本数必须至少为1 / Number of samples must be at least 1")
+
+    sizes = [min(chunk_size, samples - lo) for lo in range(0, samples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(child, level_count, start_level, q, n, size) for child, size in zip(seeds, sizes)]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) == 1:
+        results = map(_simulate_chunk, tasks)
+        return np.sum(list(results), axis=0)
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        return np.sum(list(executor.map(_simulate_chunk, tasks)), axis=0)
+
+
+def wilson_interval(counts, samples, confidence=0.95):
+    """比例的 Wilson 置信区间，样本数为0或1的等级也能给出合理区间"""
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    p = counts / samples
+    denom = 1 + z * z / samples
+    center = (p + z * z / (2 * samples)) / denom
+    half = z * np.sqrt(p * (1 - p) / samples + z * z / (4 * samples * samples)) / denom
+    return np.clip(center - half, 0, 1), np.clip(center + half, 0, 1)
+
+
+def simulate_distribution(level_count, start_level, upgrade_probabilities, n, samples,
+                          seed=None, confidence=0.95, chunk_size=1_000_000, workers=1):
+    """模拟经验分布，并给出置信区间以及与精确分布的偏差"""
+    counts = simulate_counts(level_count, start_level, upgrade_probabilities, n, samples,
+                             seed, chunk_size, workers)
+    distribution = counts / samples
+    lower, upper = wilson_interval(counts, samples, confidence)
+    exact = chest_engine.compute_distribution(level_count, start_level, upgrade_probabilities, n)
+
+    # 卡方统计量只统计精确概率非零的等级
+    expected = exact * samples
+    support = expected > 0
+    chi_square = float(np.sum((counts[support] - expected[support]) ** 2 / expected[support]))
+
+    return SimulationResult(
+        distribution=distribution,
+        lower=lower,
+        upper=upper,
+        counts=counts,
+        samples=samples,
+        exact=exact,
+        max_abs_error=float(np.max(np.abs(distribution - exact))),
+        total_variation=float(0.5 * np.sum(np.abs(distribution - exact))),
+        chi_square=chi_square,
+        degrees_of_freedom=max(int(np.count_nonzero(support)) - 1, 0),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="chest_probability_calculator.py simulate",
+        description="蒙特卡洛模拟宝箱升级 / Monte Carlo chest simulation")
+    parser.add_argument("--levels", type=int, required=True, help="宝箱等级数量 / number of levels")
+    parser.add_argument("--start", type=int, default=1, help="初始等级 / starting level")
+    parser.add_argument("--n", type=int, required=True, help="升级次数 / upgrade times")
+    parser.add_argument("--probs", required=True, help='升级概率，如 "50 45 40 30" / upgrade probabilities')
+    parser.add_argument("--samples", type=int, default=1_000_000, help="样本数 / number of samples")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子 / random seed")
+    parser.add_argument("--confidence", type=float, default=0.95, help="置信水平 / confidence level")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认全部核心 / worker processes")
+    args = parser.parse_args(argv)
+
+    probs, errors = chest_engine.parse_percentages(args.probs.replace(",", " ").split())
+    if errors:
+        parser.error(errors[0][2])
+
+    result = simulate_distribution(args.levels, args.start, probs, args.n, args.samples,
+                                   args.seed, args.confidence, workers=args.workers)
+    json.dump({
+        "samples": result.samples,
+        "distribution": result.distribution.tolist(),
+        "lower": result.lower.tolist(),
+        "upper": result.upper.tolist(),
+        "exact": result.exact.tolist(),
+        "max_abs_error": result.max_abs_error,
+        "total_variation": result.total_variation,
+        "chi_square": result.chi_square,
+        "degrees_of_freedom": result.degrees_of_freedom,
+    }, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
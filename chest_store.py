@@ -0,0 +1,305 @@
+"""场景和结果存储 / Columnar binary store for scenarios and results
+
+每个存储是一个目录，每列一个定长的二进制文件，只追加写入：
+    level_count.bin   int32   每条记录的等级数量
+    start_level.bin   int32   初始等级
+    n.bin             int64   升级次数
+    offset.bin        int64   该记录在 distribution.bin 中的起始位置
+    upgrade.bin       float64 升级概率，每条 level_count-1 个，起始位置为 offset - 行号
+    distribution.bin  float32/float64 分布，每条 level_count 个
+    meta.json         格式版本、分布的数据类型和已提交的记录数
+
+读取时用内存映射随机访问，不需要把整个文件读入内存。写入先追加各列，
+最后更新 meta.json 中的记录数，中途中断时多出的尾部数据会被忽略。
+索引是按 (level_count, start_level, n, 行号) 排序的键记录：较大的主索引 index_main.bin
+和较小的增量索引 index_tail.bin。查询时先把新追加的记录排序合并进增量索引，
+增量索引超过主索引的 1/8 时才归并进主索引；两者都在内存映射上二分查找。
+同一时间只应有一个写入者。
+"""
+import json
+import os
+
+import numpy as np
+
+FORMAT_VERSION = 1
+DTYPES = ("float32", "float64")
+
+# 列名和数据类型；分布列的数据类型由存储创建时决定
+_CONFIG_COLUMNS = (
+    ("level_count", np.dtype("<i4")),
+    ("start_level", np.dtype("<i4")),
+    ("n", np.dtype("<i8")),
+    ("offset", np.dtype("<i8")),
+)
+_UPGRADE_DTYPE = np.dtype("<f8")
+# 索引记录：键和行号，结构化数组按字段顺序比较，可直接排序和二分查找
+_INDEX_DTYPE = np.dtype([("level_count", "<i4"), ("start_level", "<i4"), ("n", "<i8"), ("row", "<i8")])
+# 增量索引不超过此行数或主索引的 1/8 时不归并
+_TAIL_MIN_ROWS = 65536
+
+
+def _int_column(values, name):
+    """转换为整数配置列，超出该列数据类型的范围时报错"""
+    dtype = dict(_CONFIG_COLUMNS)[name]
+    info = np.iinfo(dtype)
+    try:
+        values = np.asarray(values, dtype=np.int64)
+    except OverflowError:
+        values = None
+    if values is None or (values.size and (values.min() < info.min or values.max() > info.max)):
+        raise ValueError(f"{name} 超出存储的取值范围 / {name} out of range for the store "
+                         f"({info.min} to {info.max})")
+    return values.astype(dtype)
+
+
+class ResultStore:
+    """按列存储的配置和分布，只追加写入，内存映射读取
+
+    用法:
+        with ResultStore("results.store", dtype="float32") as store:
+            row = store.append(5, 1, 4, q, p)
+            rows = store.find(level_count=5, n=4)
+            level_count, start_level, n, q = store.config(rows[-1])
+    """
+
+    def __init__(self, path, dtype="float64"):
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != FORMAT_VERSION:
+                raise ValueError(f"不支持的存储格式版本 / Unsupported store version: {meta.get('version')}")
+            self.dtype = np.dtype(meta["dtype"]).newbyteorder("<")
+            self.rows = int(meta["rows"])
+            self.index_rows = int(meta.get("index_rows", 0))
+            self.tail_rows = int(meta.get("tail_rows", self.index_rows))
+        else:
+            if dtype not in DTYPES:
+                raise ValueError(f"分布的数据类型必须是 {' 或 '.join(DTYPES)} / dtype must be one of {DTYPES}")
+            os.makedirs(path, exist_ok=True)
+            self.dtype = np.dtype(dtype).newbyteorder("<")
+            self.rows = 0
+            self.index_rows = 0
+            self.tail_rows = 0
+            self._write_meta()
+        self._files = None
+        self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.rows
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _write_meta(self):
+        """原子地更新 meta.json"""
+        meta = {"version": FORMAT_VERSION, "dtype": self.dtype.name, "rows": self.rows,
+                "index_rows": self.index_rows, "tail_rows": self.tail_rows}
+        tmp_path = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+
+    def _column(self, name, dtype, length):
+        """列文件前 length 个元素的只读内存映射"""
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        cached = self._maps.get(name)
+        if cached is None or len(cached) < length:
+            cached = np.memmap(self._column_path(name), dtype=dtype, mode="r")
+            self._maps[name] = cached
+        return cached[:length]
+
+    def column(self, name):
+        """配置列（level_count、start_level、n、offset）的内存映射"""
+        for column, dtype in _CONFIG_COLUMNS:
+            if column == name:
+                return self._column(name, dtype, self.rows)
+        raise KeyError(name)
+
+    def _value_count(self):
+        """distribution.bin 中已提交的元素数"""
+        if self.rows == 0:
+            return 0
+        last = self.rows - 1
+        return int(self.column("offset")[last]) + int(self.column("level_count")[last])
+
+    def append(self, level_count, start_level, n, upgrade_probabilities, distribution):
+        """追加一条记录，返回其行号"""
+        return int(self.append_batch(level_count, [start_level], [n],
+                                     np.asarray(upgrade_probabilities, dtype=np.float64)[None, :],
+                                     np.asarray(distribution)[None, :])[0])
+
+    def append_batch(self, level_count, start_levels, ns, Q, P):
+        """追加同一等级数量的一批记录，返回行号数组
+
+        Q 的形状为 (批量, level_count-1)，P 的形状为 (批量, level_count)，
+        与 compute_distribution_batch 的输入输出一致。
+        """
+        Q = np.asarray(Q, dtype=np.float64)
+        P = np.asarray(P)
+        batch = len(P)
+        if Q.shape != (batch, level_count - 1) or P.shape != (batch, level_count):
+            raise ValueError("升级概率或分布的形状与等级数量不一致 / "
+                             "Shape of probabilities or distributions does not match the level count")
+        start_levels = np.broadcast_to(_int_column(start_levels, "start_level"), (batch,))
+        ns = np.broadcast_to(_int_column(ns, "n"), (batch,))
+
+        if self._files is None:
+            names = [name for name, _ in _CONFIG_COLUMNS] + ["upgrade", "distribution"]
+            self._files = {}
+            for name in names:
+                f = open(self._column_path(name), "ab")
+                # 截掉上次中断的写入留下的未提交数据
+                committed = self._committed_bytes(name)
+                if f.tell() != committed:
+                    f.truncate(committed)
+                    f.seek(committed)
+                self._files[name] = f
+
+        first_row = self.rows
+        offsets = self._value_count() + np.arange(batch, dtype=np.int64) * level_count
+        columns = {
+            "level_count": np.full(batch, level_count, dtype=np.int32),
+            "start_level": start_levels,
+            "n": ns,
+            "offset": offsets,
+            "upgrade": Q,
+            "distribution": P.astype(self.dtype, copy=False),
+        }
+        for name, values in columns.items():
+            dtype = dict(_CONFIG_COLUMNS).get(name, _UPGRADE_DTYPE if name == "upgrade" else self.dtype)
+            f = self._files[name]
+            f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+            f.flush()
+
+        self.rows += batch
+        self._write_meta()
+        return np.arange(first_row, self.rows)
+
+    def _committed_bytes(self, name):
+        """列文件中已提交部分的字节数"""
+        if name == "distribution":
+            return self._value_count() * self.dtype.itemsize
+        if name == "upgrade":
+            return (self._value_count() - self.rows) * _UPGRADE_DTYPE.itemsize
+        return self.rows * dict(_CONFIG_COLUMNS)[name].itemsize
+
+    def config(self, row):
+        """返回 (level_count, start_level, n, 升级概率数组)"""
+        row = self._check_row(row)
+        level_count = int(self.column("level_count")[row])
+        start = int(self.column("offset")[row]) - row
+        upgrade = self._column("upgrade", _UPGRADE_DTYPE, self._value_count() - self.rows)
+        return (level_count, int(self.column("start_level")[row]), int(self.column("n")[row]),
+                np.array(upgrade[start:start + level_count - 1]))
+
+    def distribution(self, row):
+        """返回一条记录的分布（内存映射的视图，不复制）"""
+        row = self._check_row(row)
+        offset = int(self.column("offset")[row])
+        values = self._column("distribution", self.dtype, self._value_count())
+        return values[offset:offset + int(self.column("level_count")[row])]
+
+    def distributions(self, rows):
+        """返回同一等级数量的多条记录的分布矩阵"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size == 0:
+            return np.zeros((0, 0), dtype=self.dtype)
+        level_counts = self.column("level_count")[rows]
+        if np.any(level_counts != level_counts[0]):
+            raise ValueError("记录的等级数量不同 / Rows have different level counts")
+        offsets = self.column("offset")[rows]
+        values = self._column("distribution", self.dtype, self._value_count())
+        return values[offsets[:, None] + np.arange(int(level_counts[0]))]
+
+    def _check_row(self, row):
+        row = int(row)
+        if row < 0:
+            row += self.rows
+        if not 0 <= row < self.rows:
+            raise IndexError(f"记录不存在 / Row out of range: {row}")
+        return row
+
+    def _index_keys(self, lo, hi):
+        """行号 lo 到 hi 的索引记录，已排序"""
+        keys = np.empty(hi - lo, dtype=_INDEX_DTYPE)
+        for name in ("level_count", "start_level", "n"):
+            keys[name] = self.column(name)[lo:hi]
+        keys["row"] = np.arange(lo, hi)
+        # lexsort 是稳定排序，键相同的记录保持行号顺序；比直接排序结构化数组快得多
+        return keys[np.lexsort((keys["n"], keys["start_level"], keys["level_count"]))]
+
+    def _write_index(self, name, keys):
+        """原子地替换索引文件"""
+        path = self._column_path(name)
+        keys.tofile(path + ".tmp")
+        self._maps.pop(name, None)
+        os.replace(path + ".tmp", path)
+
+    def index(self):
+        """返回 (主索引, 增量索引)，两者都按键排序；先把新追加的记录合并进来"""
+        if self.tail_rows < self.rows:
+            # 新记录排序后归并到增量索引：只排序新记录，合并为线性开销
+            tail = np.array(self._column("index_tail", _INDEX_DTYPE, self.tail_rows - self.index_rows))
+            new = self._index_keys(self.tail_rows, self.rows)
+            tail = np.insert(tail, np.searchsorted(tail, new), new)
+            if len(tail) > max(_TAIL_MIN_ROWS, self.index_rows // 8):
+                main = np.array(self._column("index_main", _INDEX_DTYPE, self.index_rows))
+                main = np.insert(main, np.searchsorted(main, tail), tail)
+                self._write_index("index_main", main)
+                tail = tail[:0]
+                self.index_rows = self.rows
+            self._write_index("index_tail", tail)
+            self.tail_rows = self.rows
+            self._write_meta()
+        return (self._column("index_main", _INDEX_DTYPE, self.index_rows),
+                self._column("index_tail", _INDEX_DTYPE, self.tail_rows - self.index_rows))
+
+    def find(self, level_count=None, start_level=None, n=None):
+        """查找匹配的行号（按行号升序）；未指定的字段不作限制
+
+        指定 level_count 时在索引上二分查找（同时指定的 start_level、n 作为键的前缀）；
+        否则逐行扫描配置列。
+        """
+        if level_count is None:
+            mask = np.ones(self.rows, dtype=bool)
+            if start_level is not None:
+                mask &= self.column("start_level") == start_level
+            if n is not None:
+                mask &= self.column("n") == n
+            return np.flatnonzero(mask)
+
+        # 键的前缀确定区间；未指定的字段取整个取值范围
+        low = np.zeros(1, dtype=_INDEX_DTYPE)
+        high = np.zeros(1, dtype=_INDEX_DTYPE)
+        prefix = start_level is not None
+        for name, value in (("level_count", level_count), ("start_level", start_level),
+                            ("n", n if prefix else None), ("row", None)):
+            info = np.iinfo(_INDEX_DTYPE[name])
+            low[name] = info.min if value is None else value
+            high[name] = info.max if value is None else value
+
+        rows = []
+        for keys in self.index():
+            lo = np.searchsorted(keys, low[0], side="left")
+            hi = np.searchsorted(keys, high[0], side="right")
+            rows.append(np.asarray(keys["row"][lo:hi]))
+        rows = np.concatenate(rows)
+        if n is not None and not prefix:
+            rows = rows[self.column("n")[rows] == n]
+        return np.sort(rows)
+
+    def close(self):
+        if self._files is not None:
+            for f in self._files.values():
+                f.close()
+            self._files = None
+        self._maps.clear()
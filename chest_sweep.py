@@ -0,0 +1,296 @@
+"""批量参数扫描 / Parameter sweep runner
+
+从参数网格或配置文件读取宝箱配置，用进程池在所有CPU核心上计算分布，
+结果以长表形式（每行一个等级的概率）逐块写入 CSV，失败的配置写入错误旁路文件。
+
+用法示例:
+    python chest_probability_calculator.py sweep --levels 5 --start 1 \
+        --n 10,100,1000 --probs "50 45 40 30" --output results.csv
+    python chest_probability_calculator.py sweep --config configs.csv --output results.csv
+    python chest_probability_calculator.py sweep --config configs.csv --store results.store
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from contextlib import nullcontext
+
+import numpy as np
+
+import chest_engine
+from chest_store import DTYPES, ResultStore
+
+RESULT_COLUMNS = ["config_id", "level_count", "start_level", "n", "level", "probability"]
+ERROR_COLUMNS = ["config_id", "error"]
+CONFIG_FIELDS = ["level_count", "start_level", "n", "probabilities"]
+
+
+def parse_int_list(value):
+    """解析逗号分隔的整数列表，支持 a-b 表示闭区间"""
+    result = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part[1:]:
+            lo, hi = part.split("-", 1)
+            result.extend(range(int(lo), int(hi) + 1))
+        else:
+            result.append(int(part))
+    return result
+
+
+def split_probabilities(value):
+    """把 "50 45 40" 或 "50;45;40" 形式的概率列表拆分为字符串列表"""
+    return value.replace(";", " ").replace(",", " ").split()
+
+
+def iter_grid_configs(levels, starts, ns, probs):
+    """按参数网格依次产出 (level_count, start_level, n, 概率字符串列表)"""
+    for level_count, start_level, n, prob in itertools.product(levels, starts, ns, probs):
+        yield level_count, start_level, n, split_probabilities(prob)
+
+
+def iter_file_configs(path):
+    """从 CSV 或 JSONL 文件中逐行读取配置
+
+    CSV 需要 level_count、start_level、n、probabilities 四列；
+    JSONL 每行为 {"level_count", "start_level", "n", "upgrade_probabilities"}。
+    无法解析的行产出 ValueError，由计算阶段记为失败配置。
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".json")):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                    probs = row["upgrade_probabilities"]
+                    if isinstance(probs, str):
+                        probs = split_probabilities(probs)
+                    yield row["level_count"], row["start_level"], row["n"], [str(p) for p in probs]
+                except (ValueError, KeyError, TypeError) as e:
+                    # 无法解析的行交给计算阶段作为失败配置报告
+                    yield ValueError(f"无法解析的配置行 / Malformed config line: {e}")
+        else:
+            for row in csv.DictReader(f):
+                # 字段不足的行中缺少的列为 None
+                missing = [name for name in CONFIG_FIELDS if row.get(name) is None]
+                if missing:
+                    yield ValueError(f"缺少字段 / Missing field: {', '.join(missing)}")
+                    continue
+                try:
+                    yield (int(row["level_count"]), int(row["start_level"]), int(row["n"]),
+                           split_probabilities(row["probabilities"]))
+                except (ValueError, KeyError, TypeError) as e:
+                    yield ValueError(f"无法解析的配置行 / Malformed config line: {e}")
+
+
+def run_chunk(chunk):
+    """在工作进程中计算一块配置，返回 (结果列表, 错误列表)
+
+    整块的概率字符串合并后一次批量解析，同一等级数量的配置合并为一次批量计算。
+    """
+    results = []
+    errors = []
+
+    # 合并整块的概率字符串，记录每条配置对应的区间
+    pending = []
+    texts = []
+    for config_id, config in chunk:
+        if isinstance(config, Exception):
+            errors.append((config_id, str(config)))
+            continue
+        level_count, start_level, n, probs = config
+        pending.append((config_id, level_count, start_level, n, len(texts), len(probs)))
+        texts.extend(probs)
+
+    values, parse_errors = chest_engine.parse_percentages(texts, validate=False)
+    parse_messages = {row: message for row, _, message in parse_errors}
+
+    groups = {}
+    for config_id, level_count, start_level, n, offset, count in pending:
+        try:
+            bad = [parse_messages[row] for row in range(offset, offset + count) if row in parse_messages]
+            if bad:
+                raise ValueError(bad[0])
+            level_count, start_level = int(level_count), int(start_level)
+            n = chest_engine.whole_steps(int(n) if isinstance(n, str) else n)
+            # 批量计算和结果存储都用 int64 保存升级次数
+            if n > np.iinfo(np.int64).max:
+                raise ValueError("升级次数超出范围 / Upgrade times out of range")
+            q = chest_engine.validate_config(level_count, start_level, values[offset:offset + count], n)
+        except Exception as e:
+            errors.append((config_id, str(e)))
+            continue
+        groups.setdefault(level_count, []).append((config_id, start_level, n, q))
+
+    for level_count, items in groups.items():
+        Q = np.array([item[3] for item in items])
+        starts = np.array([item[1] for item in items])
+        ns = np.array([item[2] for item in items])
+        try:
+            P = chest_engine.compute_distribution_batch(Q, starts, ns)
+        except Exception:
+            # 批量计算失败时逐个重算，只把真正出错的配置记入错误
+            P = []
+            for config_id, start_level, n, q in items:
+                try:
+                    P.append(chest_engine.compute_distribution(level_count, start_level, q, n))
+                except Exception as e:
+                    errors.append((config_id, str(e)))
+                    P.append(None)
+        for (config_id, start_level, n, q), p in zip(items, P):
+            if p is not None:
+                results.append((config_id, level_count, start_level, n, q, p))
+
+    return results, errors
+
+
+def _chunks(configs, chunk_size):
+    """给配置编号并按块分组"""
+    numbered = enumerate(configs)
+    while True:
+        chunk = list(itertools.islice(numbered, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _bounded_map(executor, func, chunks, workers):
+    """按完成顺序产出结果，同时最多只提交有限数量的任务，保持内存有界"""
+    pending = set()
+    for chunk in chunks:
+        pending.add(executor.submit(func, chunk))
+        if len(pending) >= workers * 2:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in as_completed(pending):
+        yield future.result()
+
+
+def error_path_for(output):
+    """错误旁路文件路径：results.csv -> results.errors.csv"""
+    root, ext = os.path.splitext(output)
+    return f"{root}.errors{ext or '.csv'}"
+
+
+def store_results(store, results):
+    """把一块结果按等级数量分组追加到结果存储"""
+    groups = {}
+    for _, level_count, start_level, n, q, p in results:
+        groups.setdefault(level_count, []).append((start_level, n, q, p))
+    for level_count, items in groups.items():
+        store.append_batch(level_count, [item[0] for item in items], [item[1] for item in items],
+                           np.array([item[2] for item in items]), np.array([item[3] for item in items]))
+
+
+def run_sweep(configs, output, workers=None, chunk_size=256, progress=sys.stderr, store=None):
+    """执行扫描，返回 (成功数, 失败数, 耗时秒)
+
+    output 为结果 CSV 路径，store 为 ResultStore；两者至少提供一个。
+    只提供 store 时错误旁路文件写在存储目录中。
+    """
+    workers = workers or os.cpu_count() or 1
+    error_output = error_path_for(output) if output else os.path.join(store.path, "errors.csv")
+    ok = failed = 0
+    start = time.perf_counter()
+    last_report = start
+
+    with (open(output, "w", newline="", encoding="utf-8") if output else nullcontext()) as out_f, \
+            open(error_output, "w", newline="", encoding="utf-8") as err_f:
+        writer = csv.writer(out_f) if output else None
+        error_writer = csv.writer(err_f)
+        if writer is not None:
+            writer.writerow(RESULT_COLUMNS)
+        error_writer.writerow(ERROR_COLUMNS)
+
+        chunks = _chunks(configs, chunk_size)
+        if workers == 1:
+            outputs = map(run_chunk, chunks)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            outputs = _bounded_map(executor, run_chunk, chunks, workers)
+
+        try:
+            for results, errors in outputs:
+                if writer is not None:
+                    for config_id, level_count, start_level, n, q, p in results:
+                        writer.writerows(
+                            (config_id, level_count, start_level, n, level, f"{prob:.17g}")
+                            for level, prob in enumerate(p, 1))
+                if store is not None:
+                    store_results(store, results)
+                error_writer.writerows(errors)
+                ok += len(results)
+                failed += len(errors)
+
+                now = time.perf_counter()
+                if progress is not None and now - last_report >= 1.0:
+                    last_report = now
+                    rate = (ok + failed) / (now - start)
+                    print(f"{ok + failed} configs, {rate:.0f} configs/s", file=progress)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    if progress is not None:
+        rate = (ok + failed) / elapsed if elapsed > 0 else float("inf")
+        print(f"完成 / done: {ok} ok, {failed} failed, {elapsed:.2f}s, {rate:.0f} configs/s",
+              file=progress)
+    return ok, failed, elapsed
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="chest_probability_calculator.py sweep",
+        description="批量计算宝箱概率分布 / Batch chest distribution sweep")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--config", help="配置文件 (.csv 或 .jsonl) / config file")
+    source.add_argument("--levels", help="等级数量列表，如 5,10 或 5-8 / level counts")
+    parser.add_argument("--start", default="1", help="初始等级列表 / starting levels")
+    parser.add_argument("--n", default="1", help="升级次数列表 / upgrade times")
+    parser.add_argument("--probs", action="append",
+                        help='升级概率，如 "50 45 40 30"，可重复 / upgrade probabilities (repeatable)')
+    parser.add_argument("--output", help="结果 CSV 文件 / result CSV file")
+    parser.add_argument("--store", help="追加到结果存储目录 / append to a result store directory")
+    parser.add_argument("--store-dtype", choices=DTYPES, default="float64",
+                        help="新建存储时分布的数据类型 / distribution dtype for a new store")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认全部核心 / worker processes")
+    parser.add_argument("--chunk-size", type=int, default=256, help="每个任务的配置数 / configs per task")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.config:
+        configs = iter_file_configs(args.config)
+    else:
+        if not args.probs:
+            parser.error("使用 --levels 时需要 --probs / --probs is required with --levels")
+        configs = iter_grid_configs(parse_int_list(args.levels), parse_int_list(args.start),
+                                    parse_int_list(args.n), args.probs)
+
+    if not args.output and not args.store:
+        parser.error("需要 --output 或 --store / --output or --store is required")
+
+    if args.store:
+        with ResultStore(args.store, args.store_dtype) as store:
+            run_sweep(configs, args.output, args.workers, args.chunk_size, store=store)
+    else:
+        run_sweep(configs, args.output, args.workers, args.chunk_size)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""界面控件 / Tk widgets for the chest calculator"""
+import tkinter as tk
+from tkinter import filedialog, messagebox, ttk
+
+import chest_profiling
+
+
+class VirtualTable(ttk.Frame):
+    """虚拟化的可滚动表格
+
+    只为可见的行创建控件，滚动时复用这些控件并从数据模型重新取值，
+    因此上千行的数据也只占用固定数量的 Tk 控件。
+    columns 为 (宽度, 是否可编辑) 的列表；get_cell(row, column) 返回显示的文本，
+    set_cell(row, column, text) 在可编辑单元格被修改时调用。
+    """
+
+    def __init__(self, parent, columns, get_cell, set_cell=None, visible_rows=10):
+        super().__init__(parent)
+        self.get_cell = get_cell
+        self.set_cell = set_cell
+        self.visible_rows = visible_rows
+        self.row_count = 0
+        self.top = 0
+        # 从模型填充控件时不触发 set_cell
+        self._filling = False
+
+        # 可见行的控件池：cells[行][列] = (控件, 变量)
+        self.cells = []
+        for r in range(visible_rows):
+            row_cells = []
+            for c, (width, editable) in enumerate(columns):
+                var = tk.StringVar()
+                if editable:
+                    widget = ttk.Entry(self, textvariable=var, width=width)
+                    var.trace_add("write", lambda *args, r=r, c=c: self._on_edit(r, c))
+                else:
+                    widget = ttk.Label(self, textvariable=var, width=width, anchor=tk.W)
+                widget.grid(row=r, column=c, sticky=tk.W, padx=(0, 5), pady=(5, 0))
+                self._bind_wheel(widget)
+                row_cells.append((widget, var))
+            self.cells.append(row_cells)
+
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.scrollbar.grid(row=0, column=len(columns), rowspan=visible_rows, sticky=(tk.N, tk.S))
+        self._bind_wheel(self)
+
+    def _bind_wheel(self, widget):
+        """绑定鼠标滚轮（Windows/macOS 使用 MouseWheel，Linux 使用 Button-4/5）"""
+        widget.bind("<MouseWheel>", lambda e: self.yview("scroll", -1 if e.delta > 0 else 1, "units"))
+        widget.bind("<Button-4>", lambda e: self.yview("scroll", -1, "units"))
+        widget.bind("<Button-5>", lambda e: self.yview("scroll", 1, "units"))
+
+    def set_row_count(self, row_count):
+        """设置总行数并刷新显示"""
+        self.row_count = row_count
+        self.refresh()
+
+    def refresh(self):
+        """从数据模型重新填充可见行"""
+        self.top = max(0, min(self.top, self.row_count - self.visible_rows))
+        self._filling = True
+        try:
+            for r, row_cells in enumerate(self.cells):
+                row = self.top + r
+                for c, (widget, var) in enumerate(row_cells):
+                    if row < self.row_count:
+                        var.set(self.get_cell(row, c))
+                        widget.grid()
+                    else:
+                        widget.grid_remove()
+        finally:
+            self._filling = False
+
+        # 行数不超过可见行数时隐藏滚动条
+        if self.row_count > self.visible_rows:
+            self.scrollbar.set(self.top / self.row_count,
+                               (self.top + self.visible_rows) / self.row_count)
+            self.scrollbar.grid()
+        else:
+            self.scrollbar.grid_remove()
+
+    def yview(self, *args):
+        """滚动条和鼠标滚轮的回调"""
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * self.row_count)
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            if args[2] == "pages":
+                amount *= self.visible_rows
+            self.top += amount
+        self.refresh()
+
+    def _on_edit(self, r, c):
+        """可编辑单元格被修改时写回数据模型"""
+        if self._filling or self.set_cell is None:
+            return
+        row = self.top + r
+        if row < self.row_count:
+            self.set_cell(row, c, self.cells[r][c][1].get())
+
+
+class DebugPanel(tk.Toplevel):
+    """调试面板：显示阶段计时和计数，开关剖析器，导出到文件"""
+
+    REFRESH_MS = 500
+
+    def __init__(self, parent, instrumentation):
+        super().__init__(parent)
+        self.instrumentation = instrumentation
+        self.title("调试 / Debug")
+
+        controls = ttk.Frame(self, padding="5")
+        controls.pack(fill=tk.X)
+        self.enabled_var = tk.BooleanVar(value=instrumentation.enabled)
+        ttk.Checkbutton(controls, text="计时 / Timing", variable=self.enabled_var,
+                        command=self._on_toggle).pack(side=tk.LEFT)
+        ttk.Button(controls, text="清零 / Reset", command=self._on_reset).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Button(controls, text="保存 / Save...", command=self._on_save).pack(side=tk.LEFT, padx=(10, 0))
+
+        self.profiler_var = tk.StringVar(value=chest_profiling.PROFILERS[0])
+        ttk.Combobox(controls, textvariable=self.profiler_var, values=chest_profiling.PROFILERS,
+                     state="readonly", width=10).pack(side=tk.LEFT, padx=(20, 0))
+        self.profiler_btn = ttk.Button(controls, command=self._on_profiler)
+        self.profiler_btn.pack(side=tk.LEFT, padx=(5, 0))
+
+        self.stats_text = tk.Text(self, height=14, width=80, font="TkFixedFont")
+        self.stats_text.pack(fill=tk.BOTH, expand=True, padx=5)
+        self.profile_text = tk.Text(self, height=16, width=80, font="TkFixedFont")
+        self.profile_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=(5, 5))
+
+        self._refresh_job = None
+        self._update_profiler_button()
+        self.refresh()
+
+    def refresh(self):
+        """刷新统计文本，窗口打开期间定期重复"""
+        if self._refresh_job is not None:
+            self.after_cancel(self._refresh_job)
+        self._set_text(self.stats_text, self.instrumentation.format_report())
+        self._refresh_job = self.after(self.REFRESH_MS, self.refresh)
+
+    def destroy(self):
+        if self._refresh_job is not None:
+            self.after_cancel(self._refresh_job)
+            self._refresh_job = None
+        super().destroy()
+
+    def _set_text(self, widget, text):
+        widget.delete(1.0, tk.END)
+        widget.insert(tk.END, text)
+
+    def _update_profiler_button(self):
+        profiler = self.instrumentation.profiler
+        running = profiler is not None and profiler.running
+        self.profiler_btn.configure(text="停止剖析 / Stop" if running else "开始剖析 / Profile")
+
+    def _on_toggle(self):
+        self.instrumentation.enabled = self.enabled_var.get()
+
+    def _on_reset(self):
+        self.instrumentation.reset()
+        self.refresh()
+
+    def _on_profiler(self):
+        profiler = self.instrumentation.profiler
+        if profiler is not None and profiler.running:
+            self.instrumentation.stop_profiler()
+            self._set_text(self.profile_text, profiler.report())
+        else:
+            self.instrumentation.start_profiler(self.profiler_var.get())
+            self._set_text(self.profile_text, "")
+        self._update_profiler_button()
+
+    def _on_save(self):
+        path = filedialog.asksaveasfilename(parent=self, defaultextension=".json",
+                                            filetypes=[("JSON", "*.json")])
+        if not path:
+            return
+        try:
+            self.instrumentation.dump(path)
+        except OSError as e:
+            messagebox.showerror("错误 / Error", str(e), parent=self)
+
+
+class ScenarioBrowser(tk.Toplevel):
+    """浏览结果存储中的场景，按等级数量、初始等级和升级次数筛选，选中后载入"""
+
+    def __init__(self, parent, store, on_load):
+        super().__init__(parent)
+        self.store = store
+        self.on_load = on_load
+        self.rows = store.find()
+        self.title("场景 / Scenarios")
+
+        filters = ttk.Frame(self, padding="5")
+        filters.pack(fill=tk.X)
+        self.filter_vars = {}
+        for name, label in (("level_count", "等级数量 / Levels"), ("start_level", "初始等级 / Start"),
+                            ("n", "升级次数 / n")):
+            ttk.Label(filters, text=label).pack(side=tk.LEFT, padx=(0, 5))
+            var = tk.StringVar()
+            ttk.Entry(filters, textvariable=var, width=8).pack(side=tk.LEFT, padx=(0, 10))
+            self.filter_vars[name] = var
+        ttk.Button(filters, text="查找 / Find", command=self._on_find).pack(side=tk.LEFT)
+
+        self.count_var = tk.StringVar()
+        ttk.Label(self, textvariable=self.count_var, padding="5").pack(fill=tk.X)
+        self.table = VirtualTable(self, [(60, False)], self._get_cell, visible_rows=12)
+        self.table.pack(fill=tk.BOTH, expand=True, padx=5)
+
+        actions = ttk.Frame(self, padding="5")
+        actions.pack(fill=tk.X)
+        ttk.Label(actions, text="行号 / Row").pack(side=tk.LEFT, padx=(0, 5))
+        self.row_var = tk.StringVar()
+        ttk.Entry(actions, textvariable=self.row_var, width=10).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(actions, text="载入 / Load", command=self._on_load).pack(side=tk.LEFT)
+
+        self._show_rows()
+
+    def _get_cell(self, row, column):
+        record = int(self.rows[row])
+        level_count, start_level, n, _ = self.store.config(record)
+        return f"#{record}  levels={level_count}  start={start_level}  n={n}"
+
+    def _show_rows(self):
+        self.count_var.set(f"{len(self.rows)} / {len(self.store)}")
+        self.table.set_row_count(len(self.rows))
+        # 默认载入最新的匹配记录
+        self.row_var.set(str(int(self.rows[-1])) if len(self.rows) else "")
+
+    def _on_find(self):
+        try:
+            filters = {name: int(var.get()) if var.get().strip() else None
+                       for name, var in self.filter_vars.items()}
+        except ValueError as e:
+            messagebox.showerror("错误 / Error", str(e), parent=self)
+            return
+        self.rows = self.store.find(**filters)
+        self._show_rows()
+
+    def _on_load(self):
+        try:
+            row = int(self.row_var.get())
+            self.store.config(row)
+        except (ValueError, IndexError) as e:
+            messagebox.showerror("错误 / Error", str(e), parent=self)
+            return
+        self.on_load(row)